@@ -0,0 +1,4 @@
+from .host import *
+from .executor import *
+from .template import *
+from .profiling import *
@@ -0,0 +1,262 @@
+import numpy as np
+import multiprocessing
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from timeit import default_timer as timer
+from .host import Host, Raster, loadFunction, blockBytes
+from .halo import HaloCache
+
+__all__ = ['TiledExecutor',
+           'ExecutionReport',
+           'SharedArray']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Computes a whole output raster of a configured Host, tile by tile, on a pool of workers:
+# . threads:   The NumPy kernels used by the functions in this repository release the GIL, so tiles overlap well.
+# . processes: For functions whose hot loops hold the GIL. Input and output rasters live in shared memory
+#              (.npy inputs are memory-mapped by each worker instead), each worker configures its own function
+#              object once, and only tile coordinates are sent to workers. Requires Python 3.8 or later.
+# A single thread computes tiles in raster order. With stitchHalos, functions that declare padding then read unpadded
+# blocks, and halos are stitched from the edges of the tiles before (see HaloCache). That only pays off where reading
+# is costlier than stitching: for in-memory and page-cached rasters, small tiles are slower stitched than padded.
+
+class TiledExecutor():
+
+    def __init__(self, host, tileSize=512, workers=None, backend='threads', stitchHalos=False):
+        if backend not in ('threads', 'processes'):
+            raise Exception("Unrecognized backend: {0}. Expected 'threads' or 'processes'.".format(backend))
+        self.host = host
+        self.tileSize = (tileSize, tileSize) if np.isscalar(tileSize) else tuple(tileSize)   # (rows, cols)
+        self.workers = max(1, workers or cpu_count())
+        self.backend = backend
+        self.stitchHalos = stitchHalos
+        self.report = self.halo = None
+
+    def tiles(self, props):
+        rows, cols = self.tileSize
+        h, w = props['height'], props['width']
+        return [((x, y), (min(rows, h-y), min(cols, w-x))) for y in range(0, h, rows) for x in range(0, w, cols)]
+
+    def run(self, cellSize=None, out=None, outMask=None):
+        # returns output pixels and mask of the whole raster at cellSize, written into out and outMask if provided:
+        # ndarrays, or SharedArrays--see sharedOutput()--that worker processes write into directly. Without them, the
+        # processes backend returns arrays in shared memory, released once no longer referenced. Into ndarrays of
+        # the caller's, it can only copy the whole output when done.
+        # Padding and band extraction are applied per tile, as configured by the function.
+        props = self.host.requestProperties(cellSize)
+        shape = self.host.blockShape(props['height'], props['width'])
+        allocate = SharedArray if self.backend == 'processes' else np.empty
+        owned = [k is None for k in (out, outMask)]
+        out = allocate(shape, props['pixelType']) if out is None else out
+        outMask = allocate(shape, 'u1') if outMask is None else outMask
+        if out.shape != shape or outMask.shape != shape:
+            raise Exception("Expected output arrays of shape {0}".format(shape))
+
+        tiles = self.tiles(props)
+        self.halo = self.haloCache(props)
+        start = timer()
+        if self.backend == 'processes':
+            try:
+                counts = self.runProcesses(props, tiles, out, outMask)
+            finally:
+                for a, isOwned in zip((out, outMask), owned):
+                    if isOwned:
+                        a.unlink()                  # no process attaches anymore; the memory lives on with the array
+        else:
+            o, m = (k.array if isinstance(k, SharedArray) else k for k in (out, outMask))
+            counts = self.map(lambda t: computeTile(self.host, props, t[0], t[1], o, m, self.halo), tiles)
+        seconds = timer() - start
+
+        self.report = ExecutionReport(len(tiles), self.workers, self.tileSize, seconds,
+                                      sum(c[0] for c in counts), sum(c[1] for c in counts))
+
+        arrays = []
+        for a, isOwned in zip((out, outMask), owned):
+            if isinstance(a, SharedArray):
+                a = a.detach() if isOwned else a.array
+            arrays.append(a)
+        return tuple(arrays)
+
+    def sharedOutput(self, cellSize=None):
+        # SharedArrays for the output pixels and mask at cellSize, to be passed to .run(), and closed and
+        # unlinked by the caller when done.
+        props = self.host.requestProperties(cellSize)
+        shape = self.host.blockShape(props['height'], props['width'])
+        return SharedArray(shape, props['pixelType']), SharedArray(shape, 'u1')
+
+    def haloCache(self, props):
+        # for one worker walking tiles in raster order, a cache holding a row of tiles' edges--None otherwise.
+        padding = self.host.configuration['padding']
+        if not self.stitchHalos or padding == 0 or self.workers != 1 or self.backend != 'threads' \
+           or getattr(self.host, 'fused', False):
+            return None
+        return HaloCache(padding, maxBlocks=-(-props['width'] // self.tileSize[1]) + 2)  # and the tile being read
+
+    def map(self, f, items):
+        if self.workers == 1:
+            return [f(k) for k in items]
+        pool = ThreadPool(self.workers)
+        try:
+            return pool.map(f, items, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def runProcesses(self, props, tiles, out, outMask):
+        shared = []
+        try:
+            rasters = {}
+            for name, r in self.host.inputs.items():
+                rasters[name] = [shareRaster(k, shared) for k in r] if isinstance(r, tuple) else shareRaster(r, shared)
+            o, m = (k if isinstance(k, SharedArray) else SharedArray(k.shape, k.dtype) for k in (out, outMask))
+            shared.extend(k for k, a in ((o, out), (m, outMask)) if k is not a)
+
+            spec = {
+                'function': self.host.source,
+                'productInfo': self.host.productInfo,
+                'scalars': self.host.scalars,
+                'rasters': rasters,
+                'props': props,
+                'output': (o.spec, m.spec),
+            }
+            pool = multiprocessing.Pool(self.workers, initializeWorker, (spec, ))
+            try:
+                counts = pool.map(computeWorkerTile, tiles, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+
+            for k, a in ((o, out), (m, outMask)):
+                if k is not a:
+                    a[...] = k.array                # the caller's own ndarray
+            return counts
+        finally:
+            for k in shared:
+                k.close()
+                k.unlink()
+
+
+def computeTile(host, props, tlc, size, out, outMask, halo=None):
+    shape = host.blockShape(*size)
+    if getattr(host, 'fused', False):
+        p, m, inputBytes = host.compute(tlc, shape, props)  # fused chains read inputs strip by strip, never whole
+    else:
+        pixelBlocks = host.readBlocks(tlc, shape, props, halo)
+        inputBytes = blockBytes(pixelBlocks)
+        p, m = host.updatePixels(tlc, shape, props, pixelBlocks)
+
+    k = (Ellipsis, slice(tlc[1], tlc[1] + size[0]), slice(tlc[0], tlc[0] + size[1]))
+    out[k] = p
+    outMask[k] = m
+    return inputBytes, p.nbytes + m.nbytes
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class SharedArray():
+    # an ndarray backed by a multiprocessing.shared_memory block. spec is a picklable (name, shape, dtype)
+    # from which other processes attach to the same memory.
+
+    def __init__(self, shape, dtype, name=None):
+        from multiprocessing import shared_memory
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None,
+                                                 size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf)
+        self.spec = (self.memory.name, shape, dtype.str)
+        self.shape, self.dtype = shape, dtype
+
+    @staticmethod
+    def attach(spec):
+        return SharedArray(spec[1], spec[2], spec[0])
+
+    def detach(self):
+        # the array, holding on to this shared memory for as long as it--or any view of it--is referenced.
+        a = self.array.view(SharedView)
+        a.owner = self
+        return a
+
+    def close(self):
+        self.array = None       # the buffer can't be released while arrays refer to it
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+
+class SharedView(np.ndarray):
+    # an ndarray on shared memory that keeps the SharedArray it belongs to, which closes the memory once collected.
+    pass
+
+
+def shareRaster(raster, shared):
+    # picklable description of a Raster: .npy sources by path, everything else copied into shared memory.
+    if raster.pixels is None:
+        raise Exception("Only rasters held in memory or in .npy files can be shared with worker processes.")
+    arrays = []
+    for source, a in zip(raster.source, (raster.pixels, raster.mask)):
+        if source is not None or a is None:
+            arrays.append(source)
+            continue
+        s = SharedArray(a.shape, a.dtype)
+        shared.append(s)
+        s.array[...] = a
+        arrays.append(s.spec)
+    return tuple(arrays) + (raster.info, raster.keyMetadata)
+
+
+def attachRaster(spec, attached):
+    arrays = []
+    for a in spec[:2]:
+        if a is not None and not hasattr(a, 'split'):
+            s = SharedArray.attach(a)
+            attached.append(s)
+            a = s.array
+        arrays.append(a)
+    return Raster(arrays[0], arrays[1], keyMetadata=spec[3], **spec[2])
+
+
+workerState = {}
+
+
+def initializeWorker(spec):
+    try:
+        configureWorker(spec)
+    except Exception as e:
+        workerState['error'] = e        # raised with the first tile; a failing initializer would be retried forever
+
+
+def configureWorker(spec):
+    attached = []
+    rasters = {}
+    for name, r in spec['rasters'].items():
+        rasters[name] = [attachRaster(k, attached) for k in r] if isinstance(r, list) else attachRaster(r, attached)
+
+    host = Host(loadFunction(*spec['function']), spec['productInfo'])
+    host.configure(**dict(spec['scalars'], **rasters))
+    out, outMask = SharedArray.attach(spec['output'][0]), SharedArray.attach(spec['output'][1])
+    workerState.update(host=host, props=spec['props'], out=out, outMask=outMask, attached=attached + [out, outMask])
+
+
+def computeWorkerTile(tile):
+    s = workerState
+    if 'error' in s:
+        raise s['error']
+    return computeTile(s['host'], s['props'], tile[0], tile[1], s['out'].array, s['outMask'].array)
+
+
+class ExecutionReport():
+
+    def __init__(self, tiles, workers, tileSize, seconds, inputBytes, outputBytes):
+        self.tiles, self.workers, self.tileSize, self.seconds = tiles, workers, tileSize, seconds
+        self.inputBytes, self.outputBytes = inputBytes, outputBytes
+        s = max(seconds, 1e-9)
+        self.tilesPerSecond = tiles / s
+        self.megabytesPerSecond = (inputBytes + outputBytes) / 2.**20 / s   # pixel blocks read plus output written
+
+    def __str__(self):
+        return ("{0} tiles of {1}x{2} on {3} worker(s) in {4:.3f} s: {5:.1f} tiles/s, {6:.1f} MB/s "
+                "({7:.1f} MB read, {8:.1f} MB written)").format(
+                    self.tiles, self.tileSize[0], self.tileSize[1], self.workers, self.seconds,
+                    self.tilesPerSecond, self.megabytesPerSecond, self.inputBytes / 2.**20, self.outputBytes / 2.**20)
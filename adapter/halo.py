@@ -0,0 +1,82 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+
+__all__ = ['HaloCache']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Input blocks of functions that declare padding overlap their neighbors by a ring of `padding` pixels. Walking
+# tiles in raster order, TiledExecutor reads unpadded blocks instead, and stitches the halo around each from the
+# edges of blocks read before. Only the bottom and right halos--and the lower-left corner--are read, as strips.
+
+class HaloCache():
+    # remembers edges of recently read, unpadded input blocks. Each block stored with .put() contributes eight
+    # regions--four edge strips and four corners, `padding` pixels thick--keyed by raster, cell size, and the
+    # region's column, row, width and height. Holding one row of tiles serves every top and left halo.
+
+    def __init__(self, padding, maxBlocks=64):
+        self.padding = padding
+        self.maxRegions = 8 * maxBlocks
+        self.hits, self.misses = 0, 0
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, name, tlc, cellSize, pixels, mask=None):
+        p = self.padding
+        x, y = tlc
+        h, w = pixels.shape[-2:]
+        edges = ((0, 0, p, w), (h-p, 0, p, w), (0, 0, h, p), (0, w-p, h, p),
+                 (0, 0, p, p), (0, w-p, p, p), (h-p, 0, p, p), (h-p, w-p, p, p))
+
+        with self._lock:
+            for i, j, hh, ww in edges:
+                key = (name, tuple(cellSize), x+j, y+i, ww, hh)
+                self._regions.pop(key, None)
+                self._regions[key] = (np.array(pixels[..., i:i+hh, j:j+ww]),
+                                      None if mask is None else np.array(mask[..., i:i+hh, j:j+ww]))
+            while len(self._regions) > self.maxRegions:
+                self._regions.popitem(last=False)
+
+    def assemble(self, name, tlc, cellSize, pixels, mask, read):
+        # the block grown by its halo. read(tlc, shape) returns (pixels, mask) of a region whose top-left pixel
+        # is tlc (column, row), and whose shape is (rows, columns). Regions outside the raster are the reader's concern.
+        p = self.padding
+        x, y = tlc
+        h, w = pixels.shape[-2:]
+        outShape = pixels.shape[:-2] + (h+2*p, w+2*p)
+        outPixels = np.empty(outShape, dtype=pixels.dtype)
+        outPixels[..., p:p+h, p:p+w] = pixels
+        outMask = None
+        if mask is not None:
+            outMask = np.empty(outShape, dtype=mask.dtype)
+            outMask[..., p:p+h, p:p+w] = mask
+
+        halo = ((0, 0, p, p), (0, p, p, w), (0, p+w, p, p),
+                (p, 0, h, p), (p, p+w, h, p),
+                (p+h, 0, p, p), (p+h, p, p, w), (p+h, p+w, p, p))
+
+        for i, j, hh, ww in halo:
+            key = (name, tuple(cellSize), x+j-p, y+i-p, ww, hh)
+            with self._lock:
+                region = self._regions.get(key, None)
+                if region is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            if region is None:
+                region = read((x+j-p, y+i-p), (hh, ww))
+
+            outPixels[..., i:i+hh, j:j+ww] = region[0]
+            if outMask is not None:
+                outMask[..., i:i+hh, j:j+ww] = region[1]
+        return outPixels, outMask
+
+    def clear(self):
+        with self._lock:
+            self._regions.clear()
+            self.hits, self.misses = 0, 0
+
+    def info(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'regions': len(self._regions), 'maxRegions': self.maxRegions}
@@ -0,0 +1,358 @@
+import sys
+import importlib
+import numpy as np
+from os import path
+from collections import OrderedDict
+
+__all__ = ['loadFunction',
+           'Raster',
+           'Host']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Emulates the ArcGIS Python Adapter well enough to drive the raster functions in this repository
+# outside of ArcGIS: the sequence of calls, and the names of keyword arguments as documented in
+# functions/Reference.py. Input rasters are NumPy arrays or .npy files held in a single spatial reference.
+
+functionsHome = path.join(path.dirname(path.dirname(path.abspath(__file__))), "functions")
+
+defaultConfiguration = {
+    'extractBands': None,
+    'compositeRasters': False,
+    'inheritProperties': 1 | 2 | 4 | 8,
+    'invalidateProperties': 0,
+    'padding': 0,
+    'samplingFactor': 1,
+    'inputMask': False,
+    'keyMetadata': (),
+}
+
+defaultProductInfo = {
+    'productName': 'Host',
+    'version': '10.3.1',
+    'path': '',
+    'major': 10,
+    'minor': 3.1,
+    'build': 4959,
+    'spNumber': 0,
+    'spBuild': 0,
+}
+
+
+def loadFunction(name, className=None):
+    # name is either the name of a module in functions/ or the path to a .py file. The class name
+    # defaults to the module name--just like the Python Adapter's.
+    home, moduleName = path.split(path.splitext(name)[0])
+    home = path.abspath(home) if home else functionsHome
+    if home not in sys.path:
+        sys.path.insert(0, home)        # functions import their siblings (utils, Hillshade, ...) by name
+    module = importlib.import_module(moduleName)
+    return getattr(module, className or moduleName)()
+
+
+def functionSource(function):
+    # (path of the module, class name) from which loadFunction() can construct the same kind of function object.
+    c = type(function)
+    return getattr(sys.modules[c.__module__], '__file__', c.__module__), c.__name__
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class Raster():
+    # pixels: ndarray of shape (rows, cols) or (bands, rows, cols), or the path to a .npy file, which is memory-mapped.
+    # mask: optional ndarray (or .npy path) of the same shape. Non-zero values mark valid pixels.
+    # Without a mask, pixels equal to noData--one value for all bands, or one per band--are invalid. keyMetadata holds dataset-level key properties.
+
+    def __init__(self, pixels, mask=None, extent=None, cellSize=(1., 1.), spatialReference=0, noData=None,
+                 keyMetadata=None, **info):
+        self.source = (pixels if hasattr(pixels, 'split') else None, mask if hasattr(mask, 'split') else None)
+        self.pixels = loadArray(pixels)
+        if self.pixels.ndim == 2:
+            self.pixels = self.pixels[np.newaxis]
+        if self.pixels.ndim != 3:
+            raise Exception("Expected pixels of shape (rows, cols) or (bands, rows, cols) but found {0}".format(self.pixels.shape))
+
+        self.mask = None if mask is None else loadArray(mask)
+        if self.mask is not None:
+            self.mask = self.mask.reshape(self.pixels.shape)
+
+        bands, rows, cols = self.pixels.shape
+        cellSize = tuple(float(c) for c in cellSize)
+        if extent is None:
+            extent = (0., 0., cols*cellSize[0], rows*cellSize[1])
+        else:
+            cellSize = ((extent[2]-extent[0])/cols, (extent[3]-extent[1])/rows)
+
+        self.info = {
+            'bandCount': bands,
+            'pixelType': self.pixels.dtype.str[1:],
+            'noData': None if noData is None else broadcastNoData(noData, self.pixels.dtype, bands),
+            'cellSize': cellSize,
+            'nativeExtent': tuple(float(e) for e in extent),
+            'nativeSpatialReference': spatialReference,
+            'geodataXform': None,
+            'extent': tuple(float(e) for e in extent),
+            'spatialReference': spatialReference,
+            'colormap': (),
+            'rasterAttributeTable': (),
+            'levelOfDetails': 1,
+            'origin': (float(extent[0]), float(extent[3])),
+            'resampling': True,
+            'bandSelection': False,
+            'histogram': (),
+            'statistics': (),
+        }
+        self.info.update(info)
+        self.keyMetadata = dict((k.lower(), v) for k, v in (keyMetadata or {}).items())
+
+    def read(self, extent, cellSize, tlc, shape, padding=0, bands=None):
+        # pixels and mask of a block--shape is (rows, cols)--of a request grid defined by extent and cellSize, grown
+        # by padding on each side. Nearest-neighbor sampling where grids differ. Pixels outside the raster are masked.
+        rows = self.gridIndexes(extent[3], -cellSize[1], tlc[1] - padding, shape[0] + 2*padding, self.info['extent'][3], -self.info['cellSize'][1])
+        cols = self.gridIndexes(extent[0], cellSize[0], tlc[0] - padding, shape[1] + 2*padding, self.info['extent'][0], self.info['cellSize'][0])
+
+        b = slice(None) if bands is None else list(bands)
+        p = self.readIndexes(self.pixels, b, rows, cols)
+        if self.mask is not None:
+            m = self.readIndexes(self.mask, b, rows, cols).astype('u1', copy=False)
+            np.not_equal(m, 0, out=m)
+        elif self.info['noData'] is not None:
+            noData = self.info['noData'] if bands is None else self.info['noData'][list(bands)]
+            m = np.not_equal(p, noData.reshape(-1, 1, 1)).astype('u1')
+        else:
+            m = np.ones(p.shape, dtype='u1')
+
+        inside = np.logical_and.outer((rows >= 0) & (rows < self.pixels.shape[1]),
+                                      (cols >= 0) & (cols < self.pixels.shape[2]))
+        if not inside.all():
+            p[:, ~inside] = 0
+            m[:, ~inside] = 0
+        return p, m
+
+    def gridIndexes(self, origin, step, first, count, rasterOrigin, rasterStep):
+        centers = origin + (np.arange(first, first + count) + 0.5) * step
+        return np.floor((centers - rasterOrigin) / rasterStep).astype('i8')
+
+    def readIndexes(self, a, bands, rows, cols):
+        n, r, c = a.shape
+        if len(rows) and rows[0] >= 0 and rows[-1] < r and rows[-1] - rows[0] == len(rows) - 1 \
+           and len(cols) and cols[0] >= 0 and cols[-1] < c and cols[-1] - cols[0] == len(cols) - 1:
+            return np.array(a[bands, rows[0]:rows[-1]+1, cols[0]:cols[-1]+1])     # aligned and inside: a plain copy
+        rows, cols = np.clip(rows, 0, r-1), np.clip(cols, 0, c-1)
+        a = a[bands, rows.min():rows.max()+1, cols.min():cols.max()+1]   # gather from the bounding window only
+        return a[:, rows - rows.min()][:, :, cols - cols.min()]
+
+
+def broadcastNoData(noData, dtype, bands):
+    # a noData value per band, from either one value for all bands or one per band.
+    v = np.array(noData, dtype=dtype).reshape(-1)
+    if v.size not in (1, bands):
+        raise Exception("Expected one noData value, or one per band ({0}), but found {1}".format(bands, v.size))
+    return np.broadcast_to(v, (bands, )).copy()
+
+
+def loadArray(a):
+    if hasattr(a, 'split'):
+        return np.load(a, mmap_mode='r')
+    return np.asanyarray(a)
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class Host():
+    # Hosts a raster function object:
+    #   h = Host('NDVI')
+    #   h.configure(raster=Raster('scene.npy'), method='Raw')
+    #   pixels, mask = h.read((0, 0), (512, 512))
+
+    def __init__(self, function, productInfo=None):
+        self.function = loadFunction(function) if hasattr(function, 'split') else function
+        self.source = functionSource(self.function)     # lets worker processes construct their own function object
+        self.productInfo = dict(defaultProductInfo, **(productInfo or {}))
+        self.parameters = self.function.getParameterInfo()
+        self.scalars, self.rasters, self.inputs, self.configuration, self.outputInfo = {}, OrderedDict(), OrderedDict(), None, None
+
+        if hasattr(self.function, 'isLicensed'):
+            r = self.function.isLicensed(**self.productInfo) or {}
+            if r.get('okToRun', True) is False:
+                raise Exception(r.get('message', None) or "Raster function is not licensed to run.")
+
+    def configure(self, **arguments):
+        # values of raster parameters are Raster objects, ndarrays or .npy paths--or sequences thereof for 'rasters'.
+        # scalars not specified take the default 'value' declared in .getParameterInfo().
+        self.scalars, self.rasters = {}, OrderedDict()     # the first raster parameter seeds output_info
+        for p in self.parameters:
+            name, dataType = p['name'], p['dataType']
+            v = arguments.pop(name, None)
+            if dataType in ('raster', 'rasters'):
+                if v is None:
+                    if p.get('required', False):
+                        raise Exception("Raster parameter '{0}' is required.".format(name))
+                    continue
+                self.rasters[name] = tuple(asRaster(r) for r in v) if dataType == 'rasters' else asRaster(v)
+            else:
+                v = p.get('value', None) if v is None else v
+                if v is None and p.get('required', False):
+                    raise Exception("Scalar parameter '{0}' is required.".format(name))
+                self.scalars[name] = v
+
+        if arguments:
+            raise Exception("Unrecognized parameters: {0}".format(", ".join(sorted(arguments))))
+
+        c = dict(defaultConfiguration)
+        if hasattr(self.function, 'getConfiguration'):
+            c.update(self.function.getConfiguration(**self.scalars) or {})
+        self.configuration = c
+
+        self.inputs = OrderedDict(self.rasters)
+        if c['compositeRasters']:
+            self.rasters = OrderedDict([('compositeraster', compositeRasters(self.rasters))])
+
+        kwargs = dict(self.scalars)
+        first = None
+        for name, r in self.rasters.items():
+            kwargs[name + '_info'] = tuple(k.info for k in r) if isinstance(r, tuple) else r.info
+            if c['keyMetadata']:
+                kwargs[name + '_keyMetadata'] = tuple(requestKeyMetadata(k, c['keyMetadata']) for k in r) \
+                    if isinstance(r, tuple) else requestKeyMetadata(r, c['keyMetadata'])
+            first = first or (r[0] if isinstance(r, tuple) else r)
+
+        kwargs['output_info'] = {} if first is None else self.inheritInfo(first.info, c)    # functions without inputs describe their own
+        if hasattr(self.function, 'updateRasterInfo'):
+            kwargs = self.function.updateRasterInfo(**kwargs)
+        self.outputInfo = kwargs['output_info']
+        return self.outputInfo
+
+    def inheritInfo(self, info, c):
+        o = dict(info)
+        if c['extractBands'] is not None:
+            o['bandCount'] = len(c['extractBands'])
+            o['noData'] = None if info['noData'] is None else info['noData'][list(c['extractBands'])]
+        if not c['inheritProperties'] & 2:
+            o['noData'] = None
+        if c['invalidateProperties'] & 2:
+            o['statistics'] = ()
+        if c['invalidateProperties'] & 4:
+            o['histogram'] = ()
+        return o
+
+    def requestProperties(self, cellSize=None):
+        o = self.outputInfo
+        e, c = o['extent'], tuple(cellSize or o['cellSize'])
+        return {
+            'extent': e,
+            'pixelType': o['pixelType'],
+            'spatialReference': o['spatialReference'],
+            'cellSize': c,
+            'width': int(round((e[2]-e[0]) / c[0])),
+            'height': int(round((e[3]-e[1]) / c[1])),
+            'noData': o.get('noData', None),
+        }
+
+    def blockShape(self, rows, cols):
+        n = self.outputInfo['bandCount']
+        return (rows, cols) if n == 1 else (n, rows, cols)
+
+    def read(self, tlc=(0, 0), shape=None, cellSize=None):
+        # requests a block of output pixels and mask. tlc is the (column, row) of the block's top-left pixel
+        # in the output raster at the given cellSize--the raster's own, by default. shape defaults to the whole raster.
+        props = self.requestProperties(cellSize)
+        shape = tuple(shape or self.blockShape(props['height'] - tlc[1], props['width'] - tlc[0]))
+        if len(shape) == 2 and self.outputInfo['bandCount'] != 1:
+            shape = self.blockShape(*shape)
+        pixelBlocks = self.readBlocks(tlc, shape, props)
+        return self.updatePixels(tlc, shape, props, pixelBlocks)
+
+    def readBlocks(self, tlc, shape, props, halo=None):
+        # halo: a HaloCache from which padded blocks are stitched, for tiles requested in raster order.
+        c = self.configuration
+        names = list(self.rasters)
+        if hasattr(self.function, 'selectRasters'):
+            names = [n for n in self.function.selectRasters(tlc, shape, props) if n in self.rasters]
+
+        f = c['samplingFactor'] or 1
+        if f != 1:      # input blocks cover the same area in f times as many rows and columns, of cells f times smaller
+            props = dict(props, cellSize=tuple(k / float(f) for k in props['cellSize']))
+            tlc, shape = tuple(int(round(k * f)) for k in tlc), tuple(int(round(k * f)) for k in shape[-2:])
+
+        pixelBlocks = {}
+        for name in names:
+            r = self.rasters[name]
+            blocks = [self.readBlock(k, tlc, shape[-2:], props, c, halo, (name, i))
+                      for i, k in enumerate(r if isinstance(r, tuple) else (r, ))]
+            p, m = tuple(b[0] for b in blocks), tuple(b[1] for b in blocks)
+            pixelBlocks[name + '_pixels'] = p if isinstance(r, tuple) else p[0]
+            if c['inputMask']:
+                pixelBlocks[name + '_mask'] = m if isinstance(r, tuple) else m[0]
+        return pixelBlocks
+
+    def readBlock(self, raster, tlc, shape, props, c, halo=None, key=None):
+        if raster.info['spatialReference'] != props['spatialReference']:
+            raise Exception("Reprojecting input rasters is not supported.")
+        if halo is not None and canStitch(raster, c, halo):
+            read = lambda t, s: raster.read(props['extent'], props['cellSize'], t, s, 0, c['extractBands'])
+            p, m = read(tlc, shape)
+            halo.put(key, tlc, props['cellSize'], p, m)
+            p, m = halo.assemble(key, tlc, props['cellSize'], p, m, read)
+        else:
+            p, m = raster.read(props['extent'], props['cellSize'], tlc, shape, c['padding'], c['extractBands'])
+        return (p[0], m[0]) if p.shape[0] == 1 else (p, m)     # single-band blocks are two-dimensional
+
+    def updatePixels(self, tlc, shape, props, pixelBlocks):
+        if hasattr(self.function, 'updatePixels'):
+            pixelBlocks = self.function.updatePixels(tlc, shape, props, **pixelBlocks)
+        elif pixelBlocks:
+            name = next(iter(pixelBlocks)).rsplit('_', 1)[0]    # functions without .updatePixels() pass pixels through
+            pixelBlocks['output_pixels'] = pixelBlocks[name + '_pixels']
+            pixelBlocks['output_mask'] = pixelBlocks.get(name + '_mask', None)
+        else:
+            raise Exception("Raster function has neither input rasters nor an .updatePixels() method.")
+
+        p = np.asarray(pixelBlocks['output_pixels'])
+        if p.shape != tuple(shape):
+            raise Exception("Expected output pixels of shape {0} but found {1}".format(tuple(shape), p.shape))
+
+        m = pixelBlocks.get('output_mask', None)
+        if m is None:
+            noData = props['noData']
+            m = np.ones(p.shape, dtype='u1') if noData is None else \
+                np.not_equal(p, np.reshape(noData, (-1, 1, 1) if p.ndim == 3 else ())).astype('u1')
+        elif np.shape(m) != p.shape:
+            raise Exception("Expected output mask of shape {0} but found {1}".format(p.shape, np.shape(m)))
+        return p, np.asarray(m)
+
+    def keyMetadata(self, names=(), bandIndex=-1, **keyMetadata):
+        if hasattr(self.function, 'updateKeyMetadata'):
+            return self.function.updateKeyMetadata(tuple(names), bandIndex, **keyMetadata)
+        return keyMetadata
+
+
+def blockBytes(pixelBlocks):
+    # bytes of the pixel and mask blocks read for a call to .updatePixels().
+    return sum(a.nbytes for v in pixelBlocks.values() for a in (v if isinstance(v, tuple) else (v, )))
+
+
+def canStitch(raster, c, halo):
+    # Raster.read() samples every pixel independently of the block it's read in, so a block stitched from
+    # regions is the same as one read with padding. Subclasses--such as outputs of chained functions--may not be.
+    return type(raster) is Raster and c['padding'] > 0 and halo.padding == c['padding']
+
+
+def requestKeyMetadata(raster, names):
+    return dict((n.lower(), raster.keyMetadata[n.lower()]) for n in names if n.lower() in raster.keyMetadata)
+
+
+def asRaster(r):
+    return r if isinstance(r, Raster) else Raster(r)
+
+
+def compositeRasters(rasters):
+    # all bands of all input rasters, in parameter order, as one multi-band raster on the grid of the first.
+    r = [k for v in rasters.values() for k in (v if isinstance(v, tuple) else (v, ))]
+    if any(k.pixels.shape[1:] != r[0].pixels.shape[1:] for k in r):
+        raise Exception("Composited rasters must have identical dimensions.")
+    i = r[0].info
+    noData = None if any(k.info['noData'] is None for k in r) else np.concatenate([k.info['noData'] for k in r])
+    masks = None if all(k.mask is None for k in r) else \
+        np.concatenate([np.ones(k.pixels.shape, 'u1') if k.mask is None else k.mask for k in r])
+    return Raster(np.concatenate([k.pixels for k in r]), masks, i['extent'], i['cellSize'], i['spatialReference'], noData)
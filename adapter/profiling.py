@@ -0,0 +1,150 @@
+import json
+import threading
+import numpy as np
+from timeit import default_timer as timer
+
+__all__ = ['Profiler',
+           'profiler',
+           'instrument']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Measures the Python Adapter callbacks of raster functions: calls, wall time histograms, bytes of pixel blocks
+# in and out, and conversions of pixel type from input to output blocks. A class is instrumented once:
+#   NDVI = instrument(NDVI)             # or Host(instrument(NDVI)()) with the local host
+#   profiler.enable()
+#   ...
+#   print(profiler.toPrometheus())
+# While the profiler is disabled, instrumented callbacks cost one attribute test each.
+
+callbacks = ('isLicensed', 'getParameterInfo', 'getConfiguration', 'selectRasters',
+             'updateRasterInfo', 'updateKeyMetadata', 'updatePixels')
+
+bucketBounds = (1e-4, 5e-4, 1e-3, 5e-3, 1e-2, 5e-2, 0.1, 0.5, 1., 5., float('inf'))    # seconds
+
+
+class Profiler():
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.metrics = {}               # (function, callback) -> metrics
+            self.conversions = {}           # (function, input dtype, output dtype) -> count
+
+    def record(self, function, callback, seconds, kwargs, result):
+        bytesIn = sum(blockBytes(v) for k, v in kwargs.items())
+        bytesOut = 0
+        if isinstance(result, dict):
+            bytesOut = sum(blockBytes(v) for k, v in result.items() if k.startswith('output_'))
+
+        conversions = ()
+        if callback == 'updatePixels' and isinstance(result, dict) and 'output_pixels' in result:
+            o = np.asarray(result['output_pixels']).dtype.name
+            conversions = set(d for k, v in kwargs.items() if k.endswith('_pixels') for d in blockTypes(v) if d != o)
+            conversions = [(d, o) for d in conversions]
+
+        with self.lock:
+            m = self.metrics.get((function, callback), None)
+            if m is None:
+                m = self.metrics[(function, callback)] = {
+                    'calls': 0, 'seconds': 0., 'buckets': [0] * len(bucketBounds), 'bytesIn': 0, 'bytesOut': 0}
+            m['calls'] += 1
+            m['seconds'] += seconds
+            m['buckets'][next(i for i, b in enumerate(bucketBounds) if seconds <= b)] += 1
+            m['bytesIn'] += bytesIn
+            m['bytesOut'] += bytesOut
+            for d, o in conversions:
+                self.conversions[(function, d, o)] = self.conversions.get((function, d, o), 0) + 1
+
+    def snapshot(self):
+        # metrics as plain dictionaries; buckets count calls that took no longer than each bound, but not the previous.
+        with self.lock:
+            return {
+                'bucketBounds': [b if b != float('inf') else None for b in bucketBounds],
+                'callbacks': [dict(m, function=f, callback=c, buckets=list(m['buckets']))
+                              for (f, c), m in sorted(self.metrics.items())],
+                'conversions': [{'function': f, 'from': d, 'to': o, 'count': n}
+                                for (f, d, o), n in sorted(self.conversions.items())],
+            }
+
+    def toJSON(self, **kwargs):
+        return json.dumps(self.snapshot(), sort_keys=True, **kwargs)
+
+    def toPrometheus(self):
+        # Prometheus text exposition format, with cumulative histogram buckets.
+        s = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help):
+            lines.extend(("# HELP {0} {1}".format(name, help), "# TYPE {0} {1}".format(name, kind)))
+
+        def labels(m, **more):
+            d = dict({'function': m['function'], 'callback': m['callback']}, **more)
+            return ",".join('{0}="{1}"'.format(k, d[k]) for k in sorted(d))
+
+        metric('raster_function_callback_seconds', 'histogram', "Wall time of raster function callbacks.")
+        for m in s['callbacks']:
+            total = 0
+            for b, n in zip(bucketBounds, m['buckets']):
+                total += n
+                le = "+Inf" if b == float('inf') else repr(b)
+                lines.append("raster_function_callback_seconds_bucket{{{0}}} {1}".format(labels(m, le=le), total))
+            lines.append("raster_function_callback_seconds_sum{{{0}}} {1!r}".format(labels(m), m['seconds']))
+            lines.append("raster_function_callback_seconds_count{{{0}}} {1}".format(labels(m), m['calls']))
+
+        for key, name, help in (('bytesIn', 'raster_function_callback_bytes_in_total', "Bytes of pixel blocks passed to callbacks."),
+                                ('bytesOut', 'raster_function_callback_bytes_out_total', "Bytes of output pixel blocks returned by callbacks.")):
+            metric(name, 'counter', help)
+            for m in s['callbacks']:
+                lines.append("{0}{{{1}}} {2}".format(name, labels(m), m[key]))
+
+        metric('raster_function_dtype_conversions_total', 'counter', "Pixel blocks whose output type differs from an input's.")
+        for c in s['conversions']:
+            lines.append('raster_function_dtype_conversions_total{{from="{0}",function="{1}",to="{2}"}} {3}'.format(
+                c['from'], c['function'], c['to'], c['count']))
+        return "\n".join(lines) + "\n"
+
+
+profiler = Profiler()
+
+
+def blockBytes(v):
+    if isinstance(v, np.ndarray):
+        return v.nbytes
+    if isinstance(v, tuple):
+        return sum(k.nbytes for k in v if isinstance(k, np.ndarray))
+    return 0
+
+
+def blockTypes(v):
+    return [k.dtype.name for k in (v if isinstance(v, tuple) else (v, )) if isinstance(k, np.ndarray)]
+
+
+def instrument(cls, profiler=profiler):
+    # a subclass of a raster function class whose callbacks report to profiler. It keeps the name and module of cls,
+    # so worker processes of TiledExecutor construct--uninstrumented--instances of cls.
+    def wrap(name, method):
+        def callback(self, *args, **kwargs):
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            start = timer()
+            result = method(self, *args, **kwargs)
+            profiler.record(cls.__name__, name, timer() - start, kwargs, result)
+            return result
+        callback.__name__ = name
+        callback.__doc__ = method.__doc__
+        return callback
+
+    methods = dict((n, wrap(n, getattr(cls, n))) for n in callbacks if hasattr(cls, n))
+    methods['__module__'] = cls.__module__
+    return type(cls.__name__, (cls, object), methods)     # object: classic classes can't be subclassed by type() in Python 2
@@ -0,0 +1,308 @@
+import threading
+import numpy as np
+import xml.etree.ElementTree as ET
+from os import path
+from collections import OrderedDict
+from .host import Host, Raster, loadFunction, functionsHome, asRaster, blockBytes
+
+__all__ = ['FunctionTemplate',
+           'Variable',
+           'parseTemplate',
+           'Chain']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Reads raster function templates (.rft.xml) and evaluates the function chains they describe with the local host.
+# Python Adapter functions are loaded from their PythonModule; the built-in functions that have an equivalent
+# in functions/ are mapped onto it. Templates nested as arguments become inputs that are computed on demand.
+
+xsiType = '{http://www.w3.org/2001/XMLSchema-instance}type'
+
+# intermediates of one row strip through fused functions. Every strip costs a pass through the host for each function,
+# and allocates new output arrays in each--functions return their blocks--so strips small enough for L2 cache cost
+# more than they save. Strips are sized for the last-level cache, and tiles smaller than this aren't split: with
+# TiledExecutor's default 512x512 tiles, intermediates are already that small. Fusion pays off for large requests,
+# such as tiles of 2048x2048 and up of a chain of two Arithmetic functions and MaskRaster (56 bytes a pixel).
+stripBytes = 1 << 24
+
+# built-in function -> (module in functions/, class name, {template argument name: parameter name})
+builtinFunctions = {
+    'SlopeFunction': ('Slope', 'Slope', {'DEM': 'raster', 'ZFactor': 'zf'}),
+    'AspectFunction': ('Aspect', 'Aspect', {'Raster': 'raster'}),
+}
+
+
+class Variable():
+    # a RasterFunctionVariable: a named argument whose value, possibly empty, can be bound when the chain is built.
+    def __init__(self, name, value=None, isDataset=False):
+        self.name, self.value, self.isDataset = name, value, isDataset
+
+
+class FunctionTemplate():
+    # a RasterFunctionTemplate: one function and its arguments--scalars, Variables, nested FunctionTemplates, or lists.
+    def __init__(self, name, functionType, arguments, home=None):
+        self.name, self.functionType, self.arguments, self.home = name, functionType, arguments, home
+        self.module = self.className = None
+
+        if functionType == 'PythonAdapterFunction':
+            m = self.arguments.pop('PythonModule', None)
+            m = m.value if isinstance(m, Variable) else m
+            if not m:
+                raise Exception("Template '{0}' doesn't specify a PythonModule.".format(name))
+            m = m.replace('\\', '/')
+            self.module = m if path.isabs(m) else path.normpath(path.join(home or '.', m))
+            c = self.arguments.pop('ClassName', None)
+            c = c.value if isinstance(c, Variable) else c
+            self.className = c or None          # defaults to the module name
+
+    def createFunction(self):
+        if self.functionType == 'PythonAdapterFunction':
+            return loadFunction(self.module, self.className), {}
+        if self.functionType in builtinFunctions:
+            m, c, names = builtinFunctions[self.functionType]
+            return loadFunction(path.join(functionsHome, m), c), names
+        raise Exception("Raster function '{0}' of template '{1}' is not supported.".format(self.functionType, self.name))
+
+
+def parseTemplate(filePath):
+    root = ET.parse(filePath).getroot()
+    return parseFunctionTemplate(root, path.dirname(path.abspath(filePath)))
+
+
+def localType(e):
+    return e.get(xsiType, '').split(':')[-1]
+
+
+def parseFunctionTemplate(e, home):
+    f = e.find('Function')
+    if f is None:
+        raise Exception("Template '{0}' has no function.".format(e.findtext('Name')))
+
+    arguments = OrderedDict()
+    a = e.find('Arguments')
+    if a is not None and localType(a) == 'RasterFunctionVariable':
+        arguments['Raster'] = parseValue(a, home)   # a lone raster argument
+    elif a is not None:
+        names = [s.text for s in a.findall('Names/String')]
+        values = list(a.find('Values') if a.find('Values') is not None else [])
+        if len(names) != len(values):
+            raise Exception("Template '{0}' has {1} argument names but {2} values.".format(e.findtext('Name'), len(names), len(values)))
+        for n, v in zip(names, values):
+            arguments[n] = parseValue(v, home)
+    return FunctionTemplate(e.findtext('Name'), localType(f), arguments, home)
+
+
+def parseValue(e, home):
+    t = localType(e)
+    if t == 'RasterFunctionTemplate':
+        return parseFunctionTemplate(e, home)
+    if t == 'RasterFunctionVariable':
+        v = e.find('Value')
+        return Variable(e.findtext('Name'), None if v is None else parseValue(v, home),
+                        (e.findtext('IsDataset') or '').strip().lower() == 'true')
+    if t.startswith('ArrayOf'):
+        return [parseValue(k, home) for k in e]
+
+    s = e.text
+    if s is None or (not s.strip() and t != 'string'):
+        return None
+    if t == 'double' or t == 'float':
+        return float(s)
+    if t in ('int', 'long', 'short', 'byte', 'unsignedByte'):
+        return int(s)
+    if t == 'boolean':
+        return s.strip().lower() in ('true', '1')
+    return s
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class Chain():
+    # evaluates a function template on local data:
+    #   c = Chain('templates/DeviationFromMean.rft.xml', {'Raster': Raster('today.npy'), 'Raster[]': ['2014.npy', '2015.npy']})
+    #   pixels, mask = c.read((0, 0), (512, 512))
+    # variables binds template variables by name, overriding the values in the template. c.host serves
+    # the output of the outermost function--and can be handed to TiledExecutor to compute the whole raster.
+    #
+    # Work is shared across the chain: identical sub-chains--same function, arguments and inputs--are built once,
+    # and while a tile is requested, identical reads of an input used by more than one function are made once.
+    # Such blocks are handed to every consumer, so they are read-only. The memo is dropped when the tile's
+    # input blocks are complete.
+
+    def __init__(self, template, variables=None):
+        self.template = parseTemplate(template) if hasattr(template, 'split') else template
+        self.variables = dict(variables or {})
+        self.nodes, self.rasters = {}, {}
+        self.request = threading.local()        # memo of the tile being requested, per thread
+        self.host = self.build(self.template, ChainHost)
+        self.host.chain = self
+        self.fuse(self.host)
+
+    def read(self, tlc=(0, 0), shape=None, cellSize=None):
+        return self.host.read(tlc, shape, cellSize)
+
+    def build(self, t, hostClass=None):
+        function, names = t.createFunction()
+        host = (hostClass or ChainNode)(function)
+        params = dict((p['name'].lower(), p) for p in host.parameters)
+
+        arguments = {}
+        for name, v in t.arguments.items():
+            p = params.get(names.get(name, name).lower(), None)
+            if p is None:
+                continue                        # functions ignore arguments they don't declare
+            v = self.resolve(v, p['dataType'] in ('raster', 'rasters'))
+            if v is not None:
+                arguments[p['name']] = v
+
+        host.configure(**arguments)
+        return host
+
+    def resolve(self, v, isRaster):
+        if isinstance(v, Variable):
+            name = v.name
+            v = self.variables.get(name, v.value)
+            if v is None and isRaster:
+                raise Exception("Template variable '{0}' is not bound to a raster.".format(name))
+        if isinstance(v, (list, tuple)):
+            return [self.resolve(k, isRaster) for k in v]
+        if isinstance(v, FunctionTemplate):
+            key = self.nodeKey(v)
+            if key not in self.nodes:
+                self.nodes[key] = SharedRaster(ChainRaster(self.build(v)), self)
+            return self.share(self.nodes[key])
+        if isRaster and v is not None:
+            if id(v) not in self.rasters:       # the same bound value is the same input everywhere
+                self.rasters[id(v)] = (SharedRaster(asRaster(v), self), v)
+            return self.share(self.rasters[id(v)][0])
+        return v
+
+    def share(self, r):
+        r.consumers += 1
+        return r
+
+    def nodeKey(self, t):
+        def key(v):
+            if isinstance(v, Variable):
+                if v.name not in self.variables:
+                    return ('variable', v.name, key(v.value))
+                b = self.variables[v.name]
+                return ('variable', v.name, b if isinstance(b, (str, int, float, bool)) else id(b))
+            if isinstance(v, FunctionTemplate):
+                return self.nodeKey(v)
+            if isinstance(v, (list, tuple)):
+                return tuple(key(k) for k in v)
+            return v
+        return (t.functionType, t.module, t.className, tuple((n, key(v)) for n, v in t.arguments.items()))
+
+    def fuse(self, host):
+        # a pointwise function--no padding, no resampling--whose chained inputs are all pointwise is fused with
+        # them: its blocks are computed in row strips that each run through the whole sub-chain before the next,
+        # so intermediates are strip-sized rather than tile-sized. rowBytes estimates a strip's memory per column.
+        inputs = [k for v in host.inputs.values() for k in (v if isinstance(v, tuple) else (v, ))]
+        chained = [k.raster.host for k in inputs if isinstance(k.raster, ChainRaster)]
+        for h in chained:
+            self.fuse(h)
+
+        host.rowBytes = 8 * host.outputInfo['bandCount']
+        for k in inputs:
+            isFused = isinstance(k.raster, ChainRaster) and isPointwise(k.raster.host)
+            host.rowBytes += k.raster.host.rowBytes if isFused else 8 * k.info['bandCount']
+        host.fused = isPointwise(host) and len(chained) > 0 and all(isPointwise(h) for h in chained)
+
+
+def isPointwise(host):
+    c = host.configuration
+    return c['padding'] == 0 and c.get('samplingFactor', 1) == 1
+
+
+class ChainNode(Host):
+    # a function in a chain, computed in row strips when fused with its inputs.
+    fused, rowBytes = False, 0
+
+    def read(self, tlc=(0, 0), shape=None, cellSize=None):
+        props = self.requestProperties(cellSize)
+        shape = tuple(shape or self.blockShape(props['height'] - tlc[1], props['width'] - tlc[0]))
+        if len(shape) == 2 and self.outputInfo['bandCount'] != 1:
+            shape = self.blockShape(*shape)
+        return self.compute(tlc, shape, props)[:2]
+
+    def compute(self, tlc, shape, props):
+        # output pixels and mask of a block, and the bytes of the input blocks read for it--strip by strip, if fused.
+        rows, cols = shape[-2:]
+        step = max(1, stripBytes // max(1, cols * self.rowBytes))
+        if not self.fused or step >= rows:
+            pixelBlocks = self.readBlocks(tlc, shape, props)
+            return self.updatePixels(tlc, shape, props, pixelBlocks) + (blockBytes(pixelBlocks), )
+
+        out = outMask = None
+        inputBytes = 0
+        for y in range(0, rows, step):
+            t, s = (tlc[0], tlc[1] + y), shape[:-2] + (min(step, rows - y), cols)
+            pixelBlocks = self.readBlocks(t, s, props)
+            inputBytes += blockBytes(pixelBlocks)
+            p, m = self.updatePixels(t, s, props, pixelBlocks)
+            if out is None:
+                out, outMask = np.empty(shape, p.dtype), np.empty(shape, m.dtype)
+            out[..., y:y+s[-2], :] = p
+            outMask[..., y:y+s[-2], :] = m
+        return out, outMask, inputBytes
+
+
+class ChainHost(ChainNode):
+    # the outermost function of a chain: scopes the memo of shared reads to each request for input blocks.
+
+    def readBlocks(self, tlc, shape, props, halo=None):
+        r = self.chain.request
+        r.memo = {}
+        try:
+            return Host.readBlocks(self, tlc, shape, props, halo)
+        finally:
+            r.memo = None
+
+
+class SharedRaster(Raster):
+    # an input of one or more functions in a chain. With more than one consumer, reads are memoized per request.
+
+    def __init__(self, raster, chain):
+        self.raster, self.chain, self.consumers = raster, chain, 0
+        self.source, self.pixels, self.mask = raster.source, raster.pixels, raster.mask
+        self.info, self.keyMetadata = raster.info, raster.keyMetadata
+
+    def read(self, extent, cellSize, tlc, shape, padding=0, bands=None):
+        memo = getattr(self.chain.request, 'memo', None)
+        if memo is None or self.consumers < 2:
+            return self.raster.read(extent, cellSize, tlc, shape, padding, bands)
+
+        key = (id(self), tuple(extent), tuple(cellSize), tuple(tlc), tuple(shape), padding,
+               None if bands is None else tuple(bands))
+        block = memo.get(key, None)
+        if block is None:
+            block = self.raster.read(extent, cellSize, tlc, shape, padding, bands)
+            for a in block:
+                a.setflags(write=False)
+            memo[key] = block
+        return block
+
+
+class ChainRaster(Raster):
+    # the output of a function in a chain, used as input to the next: blocks are computed when read.
+
+    def __init__(self, host):
+        self.host = host
+        self.source = (None, None)
+        self.pixels, self.mask = None, None
+        self.info = host.outputInfo
+        self.keyMetadata = {}
+
+    def read(self, extent, cellSize, tlc, shape, padding=0, bands=None):
+        props = self.host.requestProperties(cellSize)
+        if not np.allclose(props['extent'], extent):
+            raise Exception("Chained functions must share the extent of the output raster.")
+
+        p, m = self.host.read((tlc[0] - padding, tlc[1] - padding), (shape[0] + 2*padding, shape[1] + 2*padding), cellSize)
+        if p.ndim == 2:
+            p, m = p[np.newaxis], m[np.newaxis]
+        if bands is not None:
+            p, m = p[list(bands)], m[list(bands)]
+        return p, m
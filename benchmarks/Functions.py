@@ -0,0 +1,204 @@
+'''
+Throughput and memory of .updatePixels() for every raster function in functions/, driven by the local host.
+
+Usage:
+  $ python Functions.py [--functions NDVI,Hillshade,...] [--sizes 256,1024,4096] [--repeat 5]
+                        [--save baseline.json] [--compare baseline.json [--tolerance 0.1]]
+
+Each case configures a function on synthetic inputs of a realistic pixel type and band count, reads one
+square tile of pixel blocks, and then times calls to .updatePixels() alone. Reported per call:
+  . Mpixel/s:   output pixels per second, best of --repeat calls.
+  . alloc(MB):  peak memory allocated and held at once during a call, pooled scratch arrays included,
+                as measured by measurement.py.
+  . RSS(MB):    peak resident set size of the process running the case. Every case runs in its own
+                process, so this includes the interpreter and the case's inputs, but not earlier cases.
+
+--save writes the results as a JSON baseline. --compare reports changes relative to such a baseline and
+exits with status 1 if any case got slower, or allocates more, by more than --tolerance.
+'''
+
+import sys
+import json
+import platform
+import argparse
+import multiprocessing
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), ".."))
+from adapter import Host, Raster
+from adapter.host import functionsHome
+from measurement import measure
+
+sys.path.insert(0, functionsHome)
+import utils                                        # the buffer pool functions share, emptied before each measurement
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# synthetic inputs
+
+def elevation(n, rng):
+    z = np.cumsum(rng.uniform(-5., 5., (n, n)), axis=0) + np.cumsum(rng.uniform(-5., 5., (n, n)), axis=1)
+    return Raster(z.astype('f4'), cellSize=(30., 30.), spatialReference=3857)
+
+
+def bands(n, count, dtype, rng, low=1, high=None):
+    high = np.iinfo(dtype).max if high is None else high
+    return Raster(rng.randint(low, high, (count, n, n)).astype(dtype), cellSize=(30., 30.), spatialReference=3857)
+
+
+def field(n, low, high, rng, acquisitionDate=None):
+    return Raster(rng.uniform(low, high, (n, n)).astype('f4'), cellSize=(30., 30.), spatialReference=3857,
+                  keyMetadata={'AcquisitionDate': acquisitionDate} if acquisitionDate else None)
+
+
+# (label, function, arguments to Host.configure() for an n x n raster)
+cases = [
+    ('NDVI', 'NDVI', lambda n, r: {'raster': bands(n, 4, 'u1', r), 'red': 3, 'ir': 4, 'method': 'Raw'}),
+    ('NDVI(Colormap)', 'NDVI', lambda n, r: {'raster': bands(n, 4, 'u2', r, high=4096), 'red': 3, 'ir': 4, 'method': 'Colormap'}),
+    ('NDVI(RGB)', 'NDVI', lambda n, r: {'raster': bands(n, 4, 'u2', r, high=4096), 'red': 3, 'ir': 4, 'method': 'RGB'}),
+    ('NDVI(8-bit Colormap)', 'NDVI', lambda n, r: {'raster': bands(n, 4, 'u1', r), 'red': 3, 'ir': 4, 'method': 'Colormap'}),
+    ('SpectralIndices', 'SpectralIndices', lambda n, r: {'raster': bands(n, 7, 'u2', r, high=4096), 'indices': 'NDVI, SAVI, EVI, NDWI, NBR, MSAVI'}),
+    ('Hillshade', 'Hillshade', lambda n, r: {'raster': elevation(n, r)}),
+    ('MultidirectionalHillshade', 'MultidirectionalHillshade', lambda n, r: {'raster': elevation(n, r)}),
+    ('Slope', 'Slope', lambda n, r: {'raster': elevation(n, r)}),
+    ('Aspect', 'Aspect', lambda n, r: {'raster': elevation(n, r)}),
+    ('Aggregate', 'Aggregate', lambda n, r: {'rasters': [field(n, 0., 100., r) for k in range(3)], 'method': 'Average'}),
+    ('LinearSpectralUnmixing', 'LinearSpectralUnmixing', lambda n, r: {'raster': bands(n, 6, 'u2', r, 10, 200)}),
+    ('HeatIndex', 'HeatIndex', lambda n, r: {'temperature': field(n, 60., 110., r), 'rh': field(n, 10., 100., r)}),
+    ('Windchill', 'Windchill', lambda n, r: {'temperature': field(n, -20., 50., r), 'ws': field(n, 0., 60., r)}),
+    ('FishHabitatSuitability', 'FishHabitatSuitability', lambda n, r: {'temperature': field(n, 0., 30., r), 'salinity': field(n, 0., 40., r)}),
+    ('VineyardAnalysis', 'VineyardAnalysis', lambda n, r: {'elevation': elevation(n, r), 'slope': field(n, 0., 45., r),
+                                                           'aspect': field(n, -1., 360., r)}),
+    ('VineyardAnalysis(derive)', 'VineyardAnalysis', lambda n, r: {'elevation': elevation(n, r), 'derive': True}),
+    ('Arithmetic', 'Arithmetic', lambda n, r: {'r1': field(n, 0., 100., r), 'r2': field(n, 1., 100., r), 'op': 'Divide'}),
+    ('MaskRaster', 'MaskRaster', lambda n, r: {'r': bands(n, 1, 'u1', r), 'm': bands(n, 1, 'u1', r, 0, 2)}),
+    ('FocalStatistics', 'FocalStatistics', lambda n, r: {'raster': bands(2 * n, 3, 'u1', r), 'factor': 2}),  # n x n output cells
+    ('SelectByPixelSize', 'SelectByPixelSize', lambda n, r: {'r1': bands(n, 1, 'u1', r), 'r2': bands(n, 1, 'u1', r)}),
+    ('ConvertPerSecondToPerMonth', 'ConvertPerSecondToPerMonth', lambda n, r: {'raster': field(n, 0., 1e-3, r, acquisitionDate="2015-06-01T00:00:00")}),
+    ('Random', 'Random', lambda n, r: {}),
+]
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+def peakRSS():
+    try:
+        import resource
+    except ImportError:
+        return None                                 # not available on Windows
+    k = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return k / 2.**20 if sys.platform == 'darwin' else k / 2.**10      # bytes on macOS, kilobytes elsewhere
+
+
+def measureCase(function, arguments, n, repeat):
+    h = Host(function)
+    h.configure(**arguments(n, np.random.RandomState(0)))
+    props = h.requestProperties()
+    shape = h.blockShape(n, n)
+    blocks = h.readBlocks((0, 0), shape, props)
+    call = lambda: h.updatePixels((0, 0), shape, props, dict(blocks))   # functions may add to pixelBlocks
+    best, peak = measure(call, repeat, utils.bufferPool)
+
+    inputBytes = sum(a.nbytes for v in blocks.values() for a in (v if isinstance(v, tuple) else (v, )))
+    return {
+        'mpixelsPerSecond': n * n / best / 1e6,
+        'msPerCall': best * 1000.,
+        'allocMB': peak / 2.**20,
+        'allocPerInput': float(peak) / inputBytes if inputBytes else None,
+        'rssMB': peakRSS(),
+    }
+
+
+def runCase(queue, function, label, n, repeat):
+    try:
+        r = measureCase(function, arguments(label), n, repeat)
+    except Exception as e:
+        r = {'error': "{0}: {1}".format(type(e).__name__, e)}
+    queue.put(r)
+
+
+def arguments(label):
+    return next(c[2] for c in cases if c[0] == label)
+
+
+def isolated(label, function, n, repeat):
+    # one process per case keeps peak RSS attributable, and a crashing case from taking down the suite.
+    queue = multiprocessing.Queue()
+    p = multiprocessing.Process(target=runCase, args=(queue, function, label, n, repeat))
+    p.start()
+    try:
+        return queue.get()
+    finally:
+        p.join()
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, r in sorted(results.items()):
+        b = baseline.get(key, None)
+        if b is None or 'error' in b or 'error' in r:
+            continue
+        speed = r['mpixelsPerSecond'] / b['mpixelsPerSecond'] - 1.
+        alloc = (r['allocMB'] + 1e-3) / (b['allocMB'] + 1e-3) - 1.
+        slower, larger = speed < -tolerance, alloc > tolerance
+        print("{0:>34} {1:>+9.1f}% {2:>+9.1f}% {3}".format(
+            key, 100. * speed, 100. * alloc, "REGRESSION" if slower or larger else ""))
+        if slower or larger:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raster function benchmark suite")
+    parser.add_argument('--functions', default="", help="comma-separated case labels or function names; all by default")
+    parser.add_argument('--sizes', default="256,1024,4096", help="comma-separated tile sizes")
+    parser.add_argument('--repeat', type=int, default=5, help="timed calls per case")
+    parser.add_argument('--save', default=None, help="write results to this JSON file")
+    parser.add_argument('--compare', default=None, help="compare results with this JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative change tolerated by --compare")
+    args = parser.parse_args()
+
+    names = set(s.strip() for s in args.functions.split(',') if s.strip())
+    selected = [c for c in cases if not names or c[0] in names or c[1] in names]
+    sizes = [int(s) for s in args.sizes.split(',')]
+
+    print("{0:>26} {1:>6} {2:>10} {3:>10} {4:>10} {5:>11} {6:>9}".format(
+        "function", "tile", "Mpixel/s", "ms/call", "alloc(MB)", "alloc/input", "RSS(MB)"))
+    results = {}
+    for label, function, _ in selected:
+        for n in sizes:
+            r = isolated(label, function, n, args.repeat)
+            results["{0}/{1}".format(label, n)] = r
+            if 'error' in r:
+                print("{0:>26} {1:>6} {2}".format(label, n, r['error']))
+                continue
+            print("{0:>26} {1:>6} {2:>10.1f} {3:>10.2f} {4:>10.1f} {5:>11} {6:>9}".format(
+                label, n, r['mpixelsPerSecond'], r['msPerCall'], r['allocMB'],
+                "-" if r['allocPerInput'] is None else "{0:.2f}".format(r['allocPerInput']),
+                "-" if r['rssMB'] is None else "{0:.0f}".format(r['rssMB'])))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print("\n{0:>34} {1:>10} {2:>10}".format("case", "Mpixel/s", "alloc"))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n{0} regression(s) beyond {1:.0f}%: {2}".format(len(regressions), 100. * args.tolerance, ", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''
+Accuracy and speed of Hillshade's lookup-table mode relative to the exact formula.
+
+Usage:
+  $ python HillshadeLookupTable.py [--samples N] [--sizes 256,512,...] [--ranges 4,8,...]
+
+For every combination of table size and gradient range, shade values are computed both ways
+for the same set of gradients--drawn uniformly over slope angles in [0, maxSlope] degrees and
+over all aspects--and the differences of the resulting u1 values are reported.
+'''
+
+import sys
+import math
+import argparse
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "functions"))
+from Hillshade import Hillshade
+from measurement import bestTime
+
+
+def sampleGradients(n, maxSlope, seed=0):
+    rng = np.random.RandomState(seed)
+    slope = np.tan(np.radians(rng.uniform(0., maxSlope, n)))
+    aspect = rng.uniform(0., 2.*math.pi, n)
+    return (slope * np.cos(aspect)).astype('f4'), (slope * np.sin(aspect)).astype('f4')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hillshade lookup table accuracy report")
+    parser.add_argument('--samples', type=int, default=1 << 22, help="number of gradient samples")
+    parser.add_argument('--maxSlope', type=float, default=80., help="steepest slope sampled, in degrees")
+    parser.add_argument('--sizes', default="128,256,512,1024,2048,4096", help="comma-separated table sizes")
+    parser.add_argument('--ranges', default="2,4,8,16", help="comma-separated gradient ranges")
+    args = parser.parse_args()
+
+    dx, dy = sampleGradients(args.samples, args.maxSlope)
+    h = Hillshade()
+    exact = h.computeHillshade(dx, dy).astype('u1')
+    tExact = bestTime(lambda: h.computeHillshade(dx, dy).astype('u1'))
+
+    print("samples: {0}, max slope: {1} deg, exact: {2:.1f} Mpixel/s".format(args.samples, args.maxSlope, args.samples / tExact / 1e6))
+    print("{0:>6} {1:>6} {2:>10} {3:>9} {4:>9} {5:>9} {6:>10} {7:>8}".format(
+        "size", "range", "table(KB)", "maxErr", "meanErr", "exact(%)", "Mpixel/s", "speedup"))
+
+    for size in (int(v) for v in args.sizes.split(',')):
+        for gradientRange in (float(v) for v in args.ranges.split(',')):
+            h.prepare(lookupTableSize=size, lookupTableRange=gradientRange)
+            approx = h.lookupHillshade(dx.copy(), dy.copy())
+            e = np.abs(approx.astype('i2') - exact)
+            t = bestTime(lambda: h.lookupHillshade(dx.copy(), dy.copy())) - bestTime(lambda: (dx.copy(), dy.copy()))
+            print("{0:>6} {1:>6g} {2:>10.0f} {3:>9} {4:>9.3f} {5:>9.2f} {6:>10.1f} {7:>8.2f}".format(
+                size, gradientRange, h.params.lut.nbytes / 1024., e.max(), e.mean(), 100. * np.mean(e == 0),
+                args.samples / t / 1e6, tExact / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''
+Bytes allocated and time spent per tile by Hillshade.updatePixels().
+
+Usage:
+  $ python HillshadeMemory.py [--sizes 256,1024,4096] [--repeat 3]
+
+Three pipelines are compared on the same padded float32 elevation tiles:
+  . legacy:  two scipy.ndimage.convolve() calls over the padded block, float64 shading
+             of the whole block, and nine shifted ANDs for the mask--as Hillshade used to.
+  . precise: Hillshade with precise=True (float64 intermediates).
+  . default: Hillshade's float32 pipeline.
+
+"peak" is the largest amount of memory allocated and held at once during a call, pooled scratch arrays included,
+as measured by measurement.py.
+'''
+
+import sys
+import argparse
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "functions"))
+import utils
+from Hillshade import Hillshade
+from measurement import measure
+
+
+def legacyUpdatePixels(h, props, v, m):
+    from scipy import ndimage
+    xs, ys = h.computeScaleFactors(props)
+    xs, ys = np.float64(xs), np.float64(ys)
+    dx = ndimage.convolve(v, [[1, 0, -1], [2, 0, -2], [1, 0, -1]]) * xs
+    dy = ndimage.convolve(v, [[1, 2, 1], [0, 0, 0], [-1, -2, -1]]) * ys
+    c, a, b = (k / 255. for k in h.params.lights[0])
+    outBlock = np.clip(255 * (c + dy*a - dx*b) / np.sqrt(1. + (dx*dx + dy*dy)), 0., 255.)
+    p = outBlock[1:-1, 1:-1].astype('u1')
+    k = m[:-2, :-2] & m[1:-1, :-2] & m[2:, :-2] & m[:-2, 1:-1] & m[1:-1, 1:-1] & m[2:, 1:-1] & m[:-2, 2:] & m[1:-1, 2:] & m[2:, 2:]
+    return p, k
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hillshade memory benchmark")
+    parser.add_argument('--sizes', default="256,1024,4096", help="comma-separated tile sizes")
+    parser.add_argument('--repeat', type=int, default=3, help="timed repetitions per tile")
+    args = parser.parse_args()
+
+    print("{0:>6} {1:>8} {2:>10} {3:>10} {4:>11} {5:>10}".format(
+        "tile", "pipeline", "input(MB)", "peak(MB)", "peak/input", "ms/tile"))
+    for n in (int(s) for s in args.sizes.split(',')):
+        rng = np.random.RandomState(0)
+        v = np.cumsum(rng.uniform(-5., 5., (n+2, n+2)), axis=0).astype('f4')
+        m = np.ones((n+2, n+2), dtype='u1')
+        props = {'extent': (0., 0., 30.*n, 30.*n), 'width': n, 'height': n, 'cellSize': (30., 30.),
+                 'spatialReference': 3857, 'pixelType': 'u1'}
+
+        h = Hillshade()
+        legacy = lambda: legacyUpdatePixels(h, props, v, m)
+        pipelines = [('legacy', legacy)]
+        for name, precise in (('precise', True), ('default', False)):
+            g = Hillshade()
+            g.prepare(precise=precise)
+            pipelines.append((name, lambda g=g: g.updatePixels((0, 0), (n, n), props, raster_pixels=v, raster_mask=m)))
+
+        for name, f in pipelines:
+            t, peak = measure(f, args.repeat, utils.bufferPool)
+            print("{0:>6} {1:>8} {2:>10.2f} {3:>10.2f} {4:>11.2f} {5:>10.2f}".format(
+                n, name, v.nbytes / 2.**20, peak / 2.**20, float(peak) / v.nbytes, t * 1000.))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+'''
+Bytes allocated and time spent per tile by NDVI.updatePixels().
+
+Usage:
+  $ python NDVIMemory.py [--sizes 256,1024,4096] [--repeat 3] [--type u2]
+
+Two pipelines are compared on the same red and infrared bands of the given pixel type:
+  . legacy:  float32 copies of both bands, then a new array for every arithmetic step--as NDVI used to.
+  . default: NDVI's float32 pipeline, through the output and one pooled scratch array.
+for each of NDVI's methods. Input blocks of 8-bit pixels large enough to be looked up in NDVI's table aren't
+computed at all, so use --type u2 (the default) to measure the arithmetic at every size.
+
+"peak" is the largest amount of memory allocated and held at once during a call, pooled scratch arrays included,
+as measured by measurement.py, and "peak/input" relates it to the bytes of the two input bands.
+'''
+
+import sys
+import argparse
+from os import path
+
+import numpy as np
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), "..", "functions"))
+import utils
+from NDVI import NDVI
+from measurement import measure
+
+
+def legacyUpdatePixels(n, props, inBlock):
+    red = np.array(inBlock[0], dtype='f4')
+    ir = np.array(inBlock[1], dtype='f4')
+    np.seterr(divide='ignore')
+    outBlock = (ir - red) / (ir + red)
+    if n.applyScaling:
+        outBlock = (outBlock * 100.0) + 100.0
+    return outBlock.astype(props['pixelType'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NDVI memory benchmark")
+    parser.add_argument('--sizes', default="256,1024,4096", help="comma-separated tile sizes")
+    parser.add_argument('--repeat', type=int, default=3, help="timed repetitions per tile")
+    parser.add_argument('--type', default='u2', help="pixel type of the input bands")
+    args = parser.parse_args()
+
+    print("{0:>6} {1:>10} {2:>8} {3:>10} {4:>10} {5:>11} {6:>10}".format(
+        "tile", "method", "pipeline", "input(MB)", "peak(MB)", "peak/input", "ms/tile"))
+    for size in (int(s) for s in args.sizes.split(',')):
+        high = min(4096, np.iinfo(args.type).max) if np.dtype(args.type).kind in 'ui' else 4096
+        inBlock = np.random.RandomState(0).randint(1, high, (2, size, size)).astype(args.type)
+        mask = np.ones(inBlock.shape, 'u1')
+
+        for method in ('Raw', 'Grayscale', 'Colormap'):
+            n = NDVI()
+            info = n.updateRasterInfo(method=method, raster_info={'pixelType': args.type}, output_info={})['output_info']
+            props = {'pixelType': info['pixelType']}
+            pipelines = (('legacy', lambda: legacyUpdatePixels(n, props, inBlock)),
+                         ('default', lambda: n.updatePixels((0, 0), (size, size), props, raster_pixels=inBlock, raster_mask=mask)))
+
+            for name, f in pipelines:
+                t, peak = measure(f, args.repeat, utils.bufferPool)
+                print("{0:>6} {1:>10} {2:>8} {3:>10.2f} {4:>10.2f} {5:>11.2f} {6:>10.2f}".format(
+                    size, method, name, inBlock.nbytes / 2.**20, peak / 2.**20, float(peak) / inBlock.nbytes, t * 1000.))
+
+
+if __name__ == '__main__':
+    main()
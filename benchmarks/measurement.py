@@ -0,0 +1,43 @@
+'''
+Timing and allocation measurements shared by the benchmarks.
+
+Allocations are traced with tracemalloc, which NumPy reports its data buffers to.
+"peak" is the largest amount of memory allocated and held at once during a call. It's traced on a cold call--
+made with the buffer pool emptied first--so it includes the scratch arrays a call takes from the pool, and not
+only what a warm call allocates anew.
+'''
+
+import tracemalloc
+from timeit import default_timer as timer
+
+__all__ = ['bestTime', 'peakAllocation', 'measure']
+
+
+def bestTime(f, repeat=5):
+    # seconds taken by the fastest of `repeat` calls to f().
+    best = float('inf')
+    for k in range(repeat):
+        s = timer()
+        f()
+        best = min(best, timer() - s)
+    return best
+
+
+def peakAllocation(f, pool=None):
+    # peak bytes allocated and held at once during one call to f(), after emptying pool--a utils.BufferPool--if given.
+    if pool is not None:
+        pool.clear()
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def measure(f, repeat, pool=None):
+    # (best time, peak allocation) of f(). The allocation is of the first, cold call, which also fills the pool
+    # and any caches before the calls that are timed.
+    peak = peakAllocation(f, pool)
+    return bestTime(f, repeat), peak
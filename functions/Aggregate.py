@@ -1,4 +1,6 @@
 import numpy as np
+import utils
+from functools import partial
 
 
 class Aggregate():
@@ -32,7 +34,7 @@ class Aggregate():
     def getConfiguration(self, **scalars):
         m = scalars.get('method', 'Sum').lower()
         if m == 'average':              self.operator = np.mean
-        elif m == 'median':             self.operator = np.median
+        elif m == 'median':             self.operator = partial(np.median, overwrite_input=True)    # partitions the pooled stack in place
         elif m == 'minimum':            self.operator = np.min
         elif m == 'maximum':            self.operator = np.max
         elif m == 'standard deviation': self.operator = np.std
@@ -53,9 +55,18 @@ class Aggregate():
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         # pixelBlocks['rasters_pixels']: tuple of 2-d or 3-d array containing pixel blocks from each input raster
-        # apply the selected operator over each array in the tuple
-        outBlock = self.operator(pixelBlocks['rasters_pixels'], axis=0)
+        # apply the selected operator over each array in the tuple, stacked into a pooled array
+        inBlocks = pixelBlocks['rasters_pixels']
+        with utils.bufferPool.scratch() as s:
+            stack = s.take((len(inBlocks), ) + np.shape(inBlocks[0]), np.result_type(*inBlocks))
+            for i, b in enumerate(inBlocks):
+                stack[i] = b
+            outBlock = self.operator(stack, axis=0)
         pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
-        masks = np.array(pixelBlocks['rasters_mask'], copy=False)
-        pixelBlocks['output_mask'] = np.all(masks, axis=0).astype('u1', copy=False)
+
+        masks = pixelBlocks['rasters_mask']             # valid where all inputs are
+        outMask = np.not_equal(masks[0], 0).astype('u1')
+        for m in masks[1:]:
+            np.logical_and(outMask, m, out=outMask)
+        pixelBlocks['output_mask'] = outMask
         return pixelBlocks
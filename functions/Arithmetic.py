@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 
 
 class Arithmetic():
@@ -40,6 +41,7 @@ class Arithmetic():
         return {
             'inheritProperties': 2 | 4 | 8,
             'invalidateProperties': 2 | 4 | 8,
+            'inputMask': True,                  # output is NoData where either input is--or where dividing by zero
         }
 
     def updateRasterInfo(self, **kwargs):
@@ -55,11 +57,20 @@ class Arithmetic():
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        r1 = np.array(pixelBlocks['r1_pixels'], dtype='f4', copy=False)
-        r2 = np.array(pixelBlocks['r2_pixels'], dtype='f4', copy=False)
+        with utils.bufferPool.scratch() as s:
+            r1 = s.asType(pixelBlocks['r1_pixels'], 'f4')
+            r2 = s.asType(pixelBlocks['r2_pixels'], 'f4')
+            shape = np.broadcast(r1, r2).shape
+            outMask = np.empty(shape, 'u1')
+            np.logical_and(pixelBlocks['r1_mask'], pixelBlocks['r2_mask'], out=outMask)
 
-        np.seterr(divide='ignore')
-        pixelBlocks['output_pixels'] = self.op(r1, r2).astype(props['pixelType'], copy=False)
+            if self.op is np.divide:
+                np.logical_and(outMask, r2, out=outMask)    # division by zero is NoData
+            with np.errstate(divide='ignore', invalid='ignore'):
+                outBlock = self.op(r1, r2)
+
+        pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
+        pixelBlocks['output_mask'] = outMask
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -0,0 +1,72 @@
+import numpy as np
+import utils
+from Hillshade import Hillshade
+
+
+class Aspect(Hillshade):
+
+    def __init__(self):
+        Hillshade.__init__(self)
+        self.name = "Aspect Function"
+        self.description = ("Computes the aspect of an elevation raster: the compass direction, in degrees, "
+                            "that the downhill slope faces. Flat areas are assigned -1.")
+
+    def getParameterInfo(self):
+        return [
+            {
+                'name': 'raster',
+                'dataType': 'raster',
+                'value': None,
+                'required': True,
+                'displayName': "Input Raster",
+                'description': "The primary input raster where pixel values represent elevation.",
+            },
+        ]
+
+    def updateRasterInfo(self, **kwargs):
+        kwargs['output_info']['bandCount'] = 1
+        kwargs['output_info']['pixelType'] = 'f4'
+        kwargs['output_info']['statistics'] = ({'minimum': -1., 'maximum': 360.}, )
+        kwargs['output_info']['histogram'] = ()
+        kwargs['output_info']['resampling'] = False
+        kwargs['output_info']['colormap'] = ()
+
+        r = kwargs['raster_info']
+        if r['bandCount'] > 1:
+            raise Exception("Input raster has more than one band. Only single-band raster datasets are supported")
+
+        self.prepare(cellSizeFactor=0., sr=r['spatialReference'])
+        return kwargs
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        p = self.params
+        m = np.asarray(pixelBlocks['raster_mask'], dtype='u1')
+
+        with utils.bufferPool.scratch() as s:
+            v = s.asType(pixelBlocks['raster_pixels'], p.dtype)
+            n = v.shape[:-2] + (v.shape[-2] - 2, v.shape[-1] - 2)
+            dx, dy = self.computeGradients(v, props, p, None, s.take(n, v.dtype), s.take(n, v.dtype))
+            pixelBlocks['output_pixels'] = self.computeAspect(dx, dy).astype(props['pixelType'], copy=False)
+        pixelBlocks['output_mask'] = utils.erodeMask(m, 1)
+        return pixelBlocks
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        if bandIndex == -1:
+            keyMetadata['datatype'] = 'Scientific'
+            keyMetadata['variable'] = 'Aspect'
+        elif bandIndex == 0:
+            keyMetadata['wavelengthmin'] = None         # reset inapplicable band-specific key metadata
+            keyMetadata['wavelengthmax'] = None
+            keyMetadata['bandname'] = 'Aspect'
+        return keyMetadata
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+"""
+References:
+
+    [1]. Esri (2016): ArcGIS Desktop Help. How Aspect works.
+    http://desktop.arcgis.com/en/arcmap/latest/tools/spatial-analyst-toolbox/how-aspect-works.htm
+
+"""
@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 from datetime import datetime
 from calendar import monthrange
 
@@ -70,8 +71,14 @@ class ConvertPerSecondToPerMonth():
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        # scaled and rounded in one array: the output itself, unless it's of another type than inBlock * scaleFactor.
         inBlock = pixelBlocks['raster_pixels']
-        pixelBlocks['output_pixels'] = np.round(inBlock * self.scaleFactor).astype(props['pixelType'], copy=False)
+        dtype = np.result_type(inBlock, self.scaleFactor)
+        with utils.bufferPool.scratch() as s:
+            t = np.empty(inBlock.shape, dtype) if dtype == np.dtype(props['pixelType']) else s.take(inBlock.shape, dtype)
+            np.multiply(inBlock, self.scaleFactor, out=t)
+            np.round(t, out=t)
+            pixelBlocks['output_pixels'] = t.astype(props['pixelType'], copy=False)    # a new array whenever t is scratch
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
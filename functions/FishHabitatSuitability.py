@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 
 
 class FishHabitatSuitability():
@@ -69,35 +70,50 @@ class FishHabitatSuitability():
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)
-        s = np.array(pixelBlocks['salinity_pixels'], dtype='f4', copy=False)
-
-        # piece-wise linear parameters for temperature...
-        tMinA = 17.99
-        tMinP = 26.37
-        tMaxP = 29.15
-        tMaxA = 33.35
-
-        np.putmask(t, t <= tMinP, (t - tMinA) / (tMinP - tMinA))
-        np.putmask(t, t >= tMaxP, (t - tMaxA) / (tMaxP - tMaxA))
-        np.putmask(t, (t > tMinP) & (t < tMaxP), 1)
-        np.putmask(t, t < 0, 0)
-
-        # piece-wise linear parameters for salinity...
-        sMinA = 28.81
-        sMinP = 32.27
-        sMaxP = 35.81
-        sMaxA = 36.79
-
-        np.putmask(s, s <= sMinP, (s - sMinA) / (sMinP - sMinA))
-        np.putmask(s, s >= sMaxP, (s - sMaxA) / (sMaxP - sMaxA))
-        np.putmask(s, (s > sMinP) & (s < sMaxP), 1)
-        np.putmask(s, s < 0, 0)
-
-        # get overall probability by tying all conditions
-        pixelBlocks['output_pixels'] = np.array(t * s * self.depth).astype(props['pixelType'], copy=False)
+        with utils.bufferPool.scratch() as scratch:
+            t = scratch.copy(pixelBlocks['temperature_pixels'], 'f4')     # modified in place: never the input blocks
+            s = scratch.copy(pixelBlocks['salinity_pixels'], 'f4')
+            w = scratch.take(t.shape, 'f4')
+            m, n = scratch.take(t.shape, '?'), scratch.take(t.shape, '?')
+
+            # piece-wise linear parameters for temperature...
+            tMinA = 17.99
+            tMinP = 26.37
+            tMaxP = 29.15
+            tMaxA = 33.35
+            self.applySuitability(t, tMinA, tMinP, tMaxP, tMaxA, w, m, n)
+
+            # piece-wise linear parameters for salinity...
+            sMinA = 28.81
+            sMinP = 32.27
+            sMaxP = 35.81
+            sMaxA = 36.79
+            self.applySuitability(s, sMinA, sMinP, sMaxP, sMaxA, w, m, n)
+
+            # get overall probability by tying all conditions
+            t *= s
+            t *= self.depth
+            pixelBlocks['output_pixels'] = t.astype(props['pixelType'])     # a new array: t returns to the pool
         return pixelBlocks
 
+    def applySuitability(self, v, minA, minP, maxP, maxA, w, m, n):
+        # v, in place, ramped up from minA to minP, 1 up to maxP, and down to maxA; 0 beyond. Each step applies,
+        # in turn, to the pixels it selects, with its values and masks computed into the scratch arrays w, m and n.
+        np.less_equal(v, minP, out=m)
+        np.subtract(v, minA, out=w)
+        w /= (minP - minA)
+        np.putmask(v, m, w)
+        np.greater_equal(v, maxP, out=m)
+        np.subtract(v, maxA, out=w)
+        w /= (maxP - maxA)
+        np.putmask(v, m, w)
+        np.greater(v, minP, out=m)
+        np.less(v, maxP, out=n)
+        m &= n
+        np.putmask(v, m, 1)
+        np.less(v, 0, out=m)
+        np.putmask(v, m, 0)
+
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
         if bandIndex == -1:
             keyMetadata['datatype'] = 'Scientific'
@@ -8,7 +8,7 @@ class FocalStatistics():
         self.name = "Focal Statistics"
         self.description = ""
         self.factor = 1.0
-        self.trace = utils.Trace()
+        self.trace = utils.Trace("FocalStatistics")
 
     def getParameterInfo(self):
         return [
@@ -46,7 +46,7 @@ class FocalStatistics():
         kwargs['output_info']['statistics'] = () 
         kwargs['output_info']['histogram'] = ()
 
-        self.trace.log("Trace|FocalStatistics.updateRasterInfo|{0}\n".format(kwargs))
+        self.trace.log("Trace|FocalStatistics.updateRasterInfo|{0}\n", kwargs)
         return kwargs
         
 
@@ -65,7 +65,7 @@ class FocalStatistics():
         pixelBlocks['output_pixels'] = outP.astype(props['pixelType'])
         pixelBlocks['output_mask'] = outM.astype('u1')
 
-        self.trace.log("Trace|FocalStatistics.updatePixels|Request Raster|{0}\n".format(props))
-        self.trace.log("Trace|FocalStatistics.updatePixels|Request Size|{0}\n".format(shape))
+        self.trace.log("Trace|FocalStatistics.updatePixels|Request Raster|{0}\n", props)
+        self.trace.log("Trace|FocalStatistics.updatePixels|Request Size|{0}\n", shape)
         return pixelBlocks
 
@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 
 
 class HeatIndex():
@@ -55,20 +56,33 @@ class HeatIndex():
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)
-        r = np.array(pixelBlocks['rh_pixels'], dtype='f4', copy=False)
+        with utils.bufferPool.scratch() as s:
+            t = s.asType(pixelBlocks['temperature_pixels'], 'f4')
+            r = s.asType(pixelBlocks['rh_pixels'], 'f4')
 
-        if self.doConversion:
-            t = (9./5. * t) + 32.
+            if self.doConversion:
+                t = np.multiply(t, 9./5., out=s.take(t.shape, 'f4'))
+                t += 32.
 
-        tr = t * r
-        rr = r * r
-        tt = t * t
-        ttr = tt * r
-        trr = t * rr
-        ttrr = ttr * r
-
-        outBlock = -42.379 + (2.04901523 * t) + (10.14333127 * r) - (0.22475541 * tr) - (0.00683783 * tt) - (0.05481717 * rr) + (0.00122874 * ttr) + (0.00085282 * trr) - (0.00000199 * ttrr)
+            # -42.379 + (2.04901523 * t) + (10.14333127 * r) - (0.22475541 * tr) - (0.00683783 * tt) - (0.05481717 * rr)
+            #         + (0.00122874 * ttr) + (0.00085282 * trr) - (0.00000199 * ttrr)
+            # term by term, in that order, through three scratch arrays.
+            w, u, v = s.take(t.shape, 'f4'), s.take(t.shape, 'f4'), s.take(t.shape, 'f4')
+            outBlock = np.multiply(t, 2.04901523)
+            outBlock += -42.379
+            outBlock += np.multiply(r, 10.14333127, out=w)
+            np.multiply(t, r, out=u)                        # tr
+            outBlock -= np.multiply(u, 0.22475541, out=w)
+            np.multiply(t, t, out=v)                        # tt
+            outBlock -= np.multiply(v, 0.00683783, out=w)
+            np.multiply(r, r, out=u)                        # rr
+            outBlock -= np.multiply(u, 0.05481717, out=w)
+            v *= r                                          # ttr
+            outBlock += np.multiply(v, 0.00122874, out=w)
+            u *= t                                          # trr
+            outBlock += np.multiply(u, 0.00085282, out=w)
+            v *= r                                          # ttrr
+            outBlock -= np.multiply(v, 0.00000199, out=w)
         pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
@@ -1,16 +1,22 @@
-from scipy import ndimage
 import numpy as np
 import math
 import utils
+from collections import namedtuple
+
+
+HillshadeParameters = namedtuple('HillshadeParameters', ('illumination', 'lights', 'zf', 'ce', 'cf', 'sr', 'dtype',
+                                                         'geographic', 'lut', 'lutSize', 'lutScale', 'lutOffset'))
 
 
 class Hillshade():
+    parameterCache = utils.LRUCache(maxSize=32)     # HillshadeParameters shared by all instances, by configuration
 
     def __init__(self):
         self.name = "Hillshade Function"
         self.description = ""
         self.prepare()
         self.proj = utils.Projection()
+        self.scaleCache = utils.LRUCache(maxSize=64)
 
     def getParameterInfo(self):
         return [
@@ -22,6 +28,22 @@ class Hillshade():
                 'displayName': "Input Raster",
                 'description': "The primary input raster where pixel values represent elevation.",
             },
+            {
+                'name': 'azimuth',
+                'dataType': 'numeric',
+                'value': 315.,
+                'required': False,
+                'displayName': "Azimuth",
+                'description': "The direction of the light source, in degrees clockwise from north.",
+            },
+            {
+                'name': 'elevation',
+                'dataType': 'numeric',
+                'value': 45.,
+                'required': False,
+                'displayName': "Altitude",
+                'description': "The altitude of the light source above the horizon, in degrees.",
+            },
             {
                 'name': 'zf',
                 'dataType': 'numeric',
@@ -50,6 +72,33 @@ class Hillshade():
                                 "Specify zero to disable dynamic scaling. "
                                 "zf <- zf + cf*[p^ce]/8p."),
             },
+            {
+                'name': 'geographic',
+                'dataType': 'boolean',
+                'value': False,
+                'required': False,
+                'displayName': "Latitude-Aware Scaling",
+                'description': ("For elevation in geographic coordinates (WGS 84 or NAD 83), scale east-west gradients of each row "
+                                "by the cosine of its latitude instead of assuming a constant length of a degree."),
+            },
+            {
+                'name': 'lut',
+                'dataType': 'numeric',
+                'value': 0,
+                'required': False,
+                'displayName': "Lookup Table Size",
+                'description': ("The number of quantization steps along each gradient axis of a precomputed table of shade values. "
+                                "Trades accuracy for speed. Specify zero to evaluate the exact formula for every pixel."),
+            },
+            {
+                'name': 'precise',
+                'dataType': 'boolean',
+                'value': False,
+                'required': False,
+                'displayName': "Double Precision",
+                'description': ("Compute gradients and shading with 64-bit floating-point numbers. "
+                                "By default, 32-bit arithmetic is used throughout, halving memory traffic."),
+            },
         ]
 
     def getConfiguration(self, **scalars):
@@ -73,23 +122,32 @@ class Hillshade():
         if r['bandCount'] > 1:
             raise Exception("Input raster has more than one band. Only single-band raster datasets are supported")
 
-        self.prepare(zFactor=kwargs.get('zf', 1.),
+        self.prepare(azimuth=kwargs.get('azimuth', 315.),
+                     elevation=kwargs.get('elevation', 45.),
+                     zFactor=kwargs.get('zf', 1.),
                      cellSizeExponent=kwargs.get('ce', 0.664),
                      cellSizeFactor=kwargs.get('cf', 0.024),
-                     sr=r['spatialReference'])
+                     sr=r['spatialReference'],
+                     geographic=bool(kwargs.get('geographic', False)),
+                     lookupTableSize=int(kwargs.get('lut', 0)),
+                     precise=bool(kwargs.get('precise', False)),
+                     weights=kwargs.get('weights', None))
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        v = np.array(pixelBlocks['raster_pixels'], dtype='f4', copy=False)
-        m = np.array(pixelBlocks['raster_mask'], dtype='u1', copy=False)
-
-        dx, dy = self.computeGradients(v, props)
-        outBlock = self.computeHillshade(dx, dy)
-        pixelBlocks['output_pixels'] = outBlock[1:-1, 1:-1].astype(props['pixelType'], copy=False)
-        pixelBlocks['output_mask'] = \
-            m[:-2, :-2]  & m[1:-1, :-2]  & m[2:, :-2]  \
-          & m[:-2, 1:-1] & m[1:-1, 1:-1] & m[2:, 1:-1] \
-          & m[:-2, 2:]   & m[1:-1, 2:]   & m[2:, 2:]
+        p = self.params                                 # one consistent snapshot for the whole call
+        m = np.asarray(pixelBlocks['raster_mask'], dtype='u1')
+
+        with utils.bufferPool.scratch() as s:             # gradients, shading, and mask only for the unpadded interior
+            v = s.asType(pixelBlocks['raster_pixels'], p.dtype)
+            n = v.shape[:-2] + (v.shape[-2] - 2, v.shape[-1] - 2)
+            dx, dy = self.computeGradients(v, props, p, tlc, s.take(n, v.dtype), s.take(n, v.dtype))
+            if p.lut is not None:
+                outBlock = self.lookupHillshade(dx, dy, p)
+            else:
+                outBlock = self.computeHillshade(dx, dy, params=p)
+        pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
+        pixelBlocks['output_mask'] = utils.erodeMask(m, 1)
         return pixelBlocks
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -104,35 +162,175 @@ class Hillshade():
     # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
     # other public methods...
 
-    def prepare(self, azimuth=315., elevation=45., zFactor=1., cellSizeExponent=0.664, cellSizeFactor=0.024, sr=None):
+    def prepare(self, azimuth=315., elevation=45., zFactor=1., cellSizeExponent=0.664, cellSizeFactor=0.024, sr=None,
+                geographic=False, lookupTableSize=0, lookupTableRange=8., precise=False, weights=None):
+        # all derived constants live in one immutable HillshadeParameters object, built once per distinct
+        # configuration and shared by all instances. replacing self.params is atomic and .updatePixels() works
+        # with the snapshot it started with, so one instance can serve many threads.
+        illumination, lights = self.prepareIllumination(azimuth, elevation, weights)
+        lookupTableSize = lookupTableSize if lookupTableSize > 1 else 0
+        key = (type(self), illumination, zFactor, cellSizeExponent, cellSizeFactor, sr, geographic,
+               lookupTableSize, lookupTableRange if lookupTableSize else None, precise)
+
+        def build():
+            p = HillshadeParameters(illumination=illumination, lights=lights,
+                                    zf=zFactor, ce=cellSizeExponent, cf=cellSizeFactor, sr=sr,
+                                    dtype='f8' if precise else 'f4',    # all intermediate buffers follow the pixel block's dtype
+                                    geographic=geographic, lut=None, lutSize=0, lutScale=1., lutOffset=0.)
+            if lookupTableSize:
+                # the table is indexed by scaled gradients, so it only depends on the sun position.
+                lutScale = (lookupTableSize - 1) / (2. * lookupTableRange)
+                p = p._replace(lut=self.computeLookupTable(lookupTableSize, lookupTableRange, p),
+                               lutSize=lookupTableSize,
+                               lutScale=lutScale,
+                               lutOffset=lookupTableRange * lutScale + 0.5)     # +0.5 rounds to the nearest node upon truncation
+            return p
+
+        self.params = Hillshade.parameterCache.get(key, build)
+
+    def prepareIllumination(self, azimuth, elevation, weights=None):
+        # weights of light sources don't apply to the single light of Hillshade.
         Z = (90. - elevation) * math.pi / 180.   # solar _zenith_ angle in radians
         A = (90. - azimuth) * math.pi / 180.     # solar azimuth _arithmetic_ angle in radians
         sinZ = math.sin(Z)
-        self.cosZ = math.cos(Z)
-        self.sinZsinA = sinZ * math.sin(A)
-        self.sinZcosA = sinZ * math.cos(A)
-        self.xKernel = [[1, 0, -1], [2, 0, -2], [1, 0, -1]]
-        self.yKernel = [[1, 2, 1], [0, 0, 0], [-1, -2, -1]]
-        self.zf = zFactor
-        self.ce = cellSizeExponent
-        self.cf = cellSizeFactor
-        self.sr = sr
-
-    def computeGradients(self, pixelBlock, props):
+        light = (255. * math.cos(Z), 255. * sinZ * math.sin(A), 255. * sinZ * math.cos(A))
+        return (azimuth, elevation), (light, )
+
+    def computeGradients(self, pixelBlock, props, params=None, tlc=None, dx=None, dy=None):
+        p = self.params if params is None else params
+        xs, ys = self.computeScaleFactors(props, p)
+        if p.geographic and tlc is not None and props['spatialReference'] in (4326, 4269):
+            xs = self.computeRowScaleFactors(tlc, pixelBlock.shape[-2], props, p)   # broadcasts across columns
+        return self.computeSobel(pixelBlock, xs, ys, dx, dy)
+
+    def computeScaleFactors(self, props, params=None):
+        # tile requests arrive at a handful of distinct cell sizes (pyramid levels), so the scale
+        # factors--and the reprojection behind them--are memoized. Counters are in self.scaleCache.
+        p = self.params if params is None else params
+        return self.scaleCache.get(self.scaleKey(props, p), lambda: self.computeScaleFactorsUncached(props, p))
+
+    def computeRowScaleFactors(self, tlc, rows, props, params=None):
+        # x-scale factors, as a column vector, for each of the given number of rows of a block padded by one pixel.
+        # Tiles in the same row of a request share the vector, so it's memoized alongside the scalar factors.
+        p = self.params if params is None else params
+        key = self.scaleKey(props, p) + (tlc[1], rows)
+        return self.scaleCache.get(key, lambda: self.computeRowScaleFactorsUncached(tlc, rows, props, p))
+
+    def scaleKey(self, props, p):
+        c = props.get('cellSize', None)
+        return (props['spatialReference'], tuple(props['extent']), props['width'], props['height'],
+                None if c is None else tuple(c), p.sr, p.zf, p.ce, p.cf)
+
+    def computeScaleFactorsUncached(self, props, params=None):
+        q = self.params if params is None else params
+
         # pixel size in input raster SR...
-        p = props['cellSize'] if self.sr is None else utils.computeCellSize(props, self.sr, self.proj)
+        p = props['cellSize'] if q.sr is None else utils.computeCellSize(props, q.sr, self.proj)
 
         m = 1.11e5 if props['spatialReference'] == 4326 or props['spatialReference'] == 4269 else 1.
         if p is not None and len(p) == 2:
             p = np.multiply(p, m)   # conditional degrees to meters conversion
-            xs, ys = (self.zf + (np.power(p, self.ce) * self.cf)) / (8*p)
+            xs, ys = (q.zf + (np.power(p, q.ce) * q.cf)) / (8*p)
         else:
             xs, ys = 1., 1.         # degenerate case. shouldn't happen.
+        return float(xs), float(ys) # python floats don't promote float32 blocks in arithmetic
+
+    def computeRowScaleFactorsUncached(self, tlc, rows, props, params=None):
+        q = self.params if params is None else params
+        p = props['cellSize'] if q.sr is None else utils.computeCellSize(props, q.sr, self.proj)
+        if p is None or len(p) != 2:
+            return self.computeScaleFactorsUncached(props, q)[0]
+
+        # latitude at the center of each row, starting with the top padding row, clamped short of the poles.
+        e = props['extent']
+        dY = (e[3]-e[1]) / props['height']
+        yMax = utils.computePixelBlockExtents(tlc, (rows-2, 1), props)[3]
+        lat = np.clip(yMax + dY*(0.5 - np.arange(rows)), -89.9, 89.9)
+
+        # length of a degree of longitude shrinks with cos(latitude).
+        px = p[0] * 1.11e5 * np.cos(np.radians(lat))
+        xs = (q.zf + (np.power(px, q.ce) * q.cf)) / (8*px)
+        return xs.astype(q.dtype).reshape(-1, 1)
+
+    def computeSobel(self, z, xs=1., ys=1., dx=None, dy=None):
+        # Sobel gradients of the interior of a block padded by one pixel on each side, computed in a single
+        # pass over shared stencil differences and with the scale factors folded in. Output is two pixels
+        # smaller than z in each of the last two dimensions, written into dx and dy if provided.
+        r, c = z.shape[-2:]
+        outShape = z.shape[:-2] + (r-2, c-2)
+        dx = np.empty(outShape, dtype=z.dtype) if dx is None else dx
+        dy = np.empty(outShape, dtype=z.dtype) if dy is None else dy
+
+        with utils.bufferPool.scratch() as s:
+            t = s.take((z.size, ), z.dtype)                     # scratch shared by both directions
+
+            d = t[:z.size//c*(c-2)].reshape(z.shape[:-2] + (r, c-2))
+            np.subtract(z[..., :, 2:], z[..., :, :-2], out=d)   # east minus west, on every row
+            d *= xs
+            np.add(d[..., :-2, :], d[..., 2:, :], out=dx)        # 1-2-1 weights across rows
+            dx += d[..., 1:-1, :]
+            dx += d[..., 1:-1, :]
+
+            d = t[:z.size//r*(r-2)].reshape(z.shape[:-2] + (r-2, c))
+            np.subtract(z[..., 2:, :], z[..., :-2, :], out=d)   # south minus north, on every column
+            d *= ys
+            np.add(d[..., :, :-2], d[..., :, 2:], out=dy)        # 1-2-1 weights across columns
+            dy += d[..., :, 1:-1]
+            dy += d[..., :, 1:-1]
+        return dx, dy
+
+    def computeHillshade(self, dx, dy, out=None, params=None):
+        c, a, b = (self.params if params is None else params).lights[0]
+        with utils.bufferPool.scratch() as s:
+            t = np.multiply(dx, b, out=s.take(dx.shape, dx.dtype))     # 255 * (cosZ + dy.sinZsinA - dx.sinZcosA)
+            out = np.multiply(dy, a, out=out)
+            out -= t
+            out += c
+            np.hypot(dx, dy, out=t)                             # ... divided by sqrt(1 + dx^2 + dy^2)
+            np.hypot(t, 1., out=t)
+            out /= t
+        return np.clip(out, 0., 255., out=out)
+
+    def computeSlope(self, dx, dy, out=None):
+        # slope in degrees. out may alias dx or dy.
+        out = np.hypot(dx, dy, out=out)
+        np.arctan(out, out=out)
+        return np.degrees(out, out=out)
+
+    def computeAspect(self, dx, dy, out=None):
+        # aspect in compass degrees [0, 360) clockwise from north, -1 where flat. out may alias dx or dy.
+        # (90 - atan2(dz/dy, -dz/dx)) of ref. [1] is the same angle as atan2(dz/dy, dz/dx) - 90, wrapped.
+        flat = (dx == 0.) & (dy == 0.)
+        out = np.arctan2(dy, dx, out=out)
+        np.degrees(out, out=out)
+        out -= 90.
+        np.add(out, 360., out=out, where=out < 0.)
+        np.putmask(out, flat, -1.)
+        return out
 
-        return (ndimage.convolve(pixelBlock, self.xKernel)*xs, ndimage.convolve(pixelBlock, self.yKernel)*ys)
+    def computeLookupTable(self, size, gradientRange, params=None):
+        # u1 shade values at size x size nodes evenly spaced over [-gradientRange, gradientRange] along dx and dy.
+        # ravelled so that lookupHillshade() can gather with a combined index.
+        g = np.linspace(-gradientRange, gradientRange, size)
+        dx, dy = np.meshgrid(g, g, indexing='ij')
+        return self.computeHillshade(dx, dy, params=params).astype('u1').ravel()
 
-    def computeHillshade(self, dx, dy):
-        return np.clip(255 * (self.cosZ + dy*self.sinZsinA - dx*self.sinZcosA) / np.sqrt(1. + (dx*dx + dy*dy)), 0., 255.)
+    def lookupHillshade(self, dx, dy, params=None):
+        # quantize gradients to the nearest table node (in place), then gather. Gradients steeper
+        # than the table's range are clamped to its edge, and undefined ones--next to NaN NoData,
+        # which the mask excludes anyway--are looked up as flat.
+        p = self.params if params is None else params
+        n = p.lutSize
+        for d in (dx, dy):
+            d *= p.lutScale
+            d += p.lutOffset
+            np.clip(d, 0., n - 0.5, out=d)
+            np.nan_to_num(d, copy=False)
+        with utils.bufferPool.scratch() as s:
+            k, j = s.copy(dx, 'i4'), s.copy(dy, 'i4')
+            k *= n
+            k += j
+            return np.take(p.lut, k)
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
 
@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 
 class LinearSpectralUnmixing():
 
@@ -103,7 +104,7 @@ class LinearSpectralUnmixing():
         # store the model solution and residual sum of squares (RSS)
         model, resid = np.linalg.lstsq(self.coefficients, y)[:2]
 
-        endmembers = np.array([endmember.reshape(-1, inBlock.shape[-1]) for endmember in model])
+        endmembers = model.reshape(model.shape[0], -1, inBlock.shape[-1])     # a view: model is ours to modify
         if self.applyScaling:
             # clip negative values and scale from 0.0 to 1.0
             endmembers.clip(min=0, out=endmembers)
@@ -111,7 +112,12 @@ class LinearSpectralUnmixing():
 
             # calculate R2
             RSS = resid                                     # without modification, resid is in fact RSS
-            TSS = np.sum((y - y.mean())**2, axis=0)         # total sum of squares
+            with utils.bufferPool.scratch() as s:
+                mean = y.mean()
+                d = s.take(y.shape, np.result_type(y, mean))
+                np.subtract(y, mean, out=d)
+                np.square(d, out=d)
+                TSS = np.sum(d, axis=0)                     # total sum of squares
             R2 = 1 - RSS / TSS
             resid = R2.reshape(1, -1, inBlock.shape[-1])
         else:
@@ -29,6 +29,8 @@ class MaskRaster():
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         pixelBlocks['output_pixels'] = pixelBlocks['r_pixels'].astype(props['pixelType'], copy=False)
-        m = pixelBlocks['m_pixels'].astype('u1', copy=False) > 0
-        pixelBlocks['output_mask'] = np.putmask(np.zeros(shape, 'u1'), m, 1)
+        outMask = np.empty(shape, 'u1')                 # mask values, as 8-bit integers, are valid if non-zero
+        np.copyto(outMask, pixelBlocks['m_pixels'], casting='unsafe')
+        np.not_equal(outMask, 0, out=outMask)
+        pixelBlocks['output_mask'] = outMask
         return pixelBlocks
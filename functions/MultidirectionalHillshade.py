@@ -0,0 +1,95 @@
+import numpy as np
+import math
+import utils
+from Hillshade import Hillshade
+
+
+class MultidirectionalHillshade(Hillshade):
+
+    def __init__(self):
+        Hillshade.__init__(self)
+        self.name = "Multidirectional Hillshade Function"
+        self.description = ("Blends hillshades illuminated from multiple directions, computed from a "
+                            "single set of surface gradients, for improved visualization of terrain.")
+
+    def getParameterInfo(self):
+        params = Hillshade.getParameterInfo(self)
+        for p in params:
+            if p['name'] == 'azimuth':
+                p.update({
+                    'dataType': 'string',
+                    'value': "225, 270, 315, 360",
+                    'displayName': "Azimuths",
+                    'description': "A comma-separated list of azimuths of the light sources, in degrees clockwise from north.",
+                })
+            elif p['name'] == 'elevation':
+                p['description'] = "The altitude of all light sources above the horizon, in degrees."
+
+        return params + [
+            {
+                'name': 'weights',
+                'dataType': 'string',
+                'value': "",
+                'required': False,
+                'displayName': "Weights",
+                'description': ("A comma-separated list of the relative contributions of each light source. "
+                                "Leave empty to weigh all light sources equally."),
+            },
+        ]
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        keyMetadata = Hillshade.updateKeyMetadata(self, names, bandIndex, **keyMetadata)
+        if bandIndex == 0:
+            keyMetadata['bandname'] = 'MultidirectionalHillshade'
+        return keyMetadata
+
+    # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+    # other public methods...
+
+    def prepare(self, azimuth="225, 270, 315, 360", elevation=45., weights=None, **kwargs):
+        Hillshade.prepare(self, azimuth, elevation, weights=weights, **kwargs)
+
+    def prepareIllumination(self, azimuth, elevation, weights=None):
+        # weights: one per azimuth, as a comma-separated string or a sequence. Empty or None weighs all lights equally.
+        A = np.radians(90. - np.array(parseValues(azimuth), dtype='f8'))
+        w = np.array(parseValues(weights) if weights is not None else [], dtype='f8')
+        w = w if len(w) else np.ones(len(A))
+        if len(w) != len(A):
+            raise Exception("Expected {0} weights--one for each azimuth--but found {1}.".format(len(A), len(w)))
+        if np.any(w < 0.) or w.sum() <= 0.:
+            raise Exception("Weights must be non-negative with a positive sum.")
+
+        # fold the normalized weights and the 255 scale into per-light coefficients.
+        # clipping each light at zero commutes with these non-negative scales.
+        w = 255. * w / w.sum()
+        Z = (90. - elevation) * math.pi / 180.
+        sinZ = math.sin(Z)
+        c, a, b = w * math.cos(Z), w * sinZ * np.sin(A), w * sinZ * np.cos(A)
+        lights = tuple(zip(c.tolist(), a.tolist(), b.tolist()))     # python floats keep float32 blocks in float32
+        return (tuple(A.tolist()), elevation, tuple(w.tolist())), lights
+
+    def computeHillshade(self, dx, dy, out=None, params=None):
+        # sum over lights k of: max(0, c_k + dy.a_k - dx.b_k), then divided by sqrt(1 + dx^2 + dy^2), clipped to 255.
+        # the normal length is shared, so each additional light costs a handful of multiply-adds per pixel.
+        out = np.zeros_like(dx) if out is None else out
+        out.fill(0.)
+        with utils.bufferPool.scratch() as scratch:
+            s, t = scratch.take(out.shape, out.dtype), scratch.take(out.shape, out.dtype)
+            for c, a, b in (self.params if params is None else params).lights:
+                np.multiply(dy, a, out=s)
+                np.multiply(dx, b, out=t)
+                s -= t
+                s += c
+                np.maximum(s, 0., out=s)
+                out += s
+
+            np.hypot(dx, dy, out=t)
+            np.hypot(t, 1., out=t)
+            out /= t
+        return np.clip(out, 0., 255., out=out)
+
+
+def parseValues(v):
+    if hasattr(v, 'split'):
+        return [float(s) for s in v.split(',') if s.strip()]
+    return [float(s) for s in v] if hasattr(v, '__iter__') else [float(v)]
@@ -1,12 +1,18 @@
 import numpy as np
+import utils
+import colormaps
 
 
 class NDVI():
+    tableCache = utils.LRUCache(maxSize=8)      # output tables of 8-bit inputs, shared by all instances
+
     def __init__(self):
         self.name = "NDVI Function"
         self.description = "Computes Normalized Difference Vegetation Index given a raster's Red and Infrared band."
         self.applyScaling = True
         self.applyColormap = False
+        self.table = None
+        self.colorizer = None
 
 
     def getParameterInfo(self):
@@ -40,10 +46,11 @@ class NDVI():
                 'dataType': 'string',
                 'value': 'Colormap',
                 'required': False,
-                'domain': ('Raw', 'Grayscale', 'Colormap'),
+                'domain': ('Raw', 'Grayscale', 'Colormap', 'RGB'),
                 'displayName': "Output Image Type",
                 'description': ("The type of output expected from this function. Specify Raw for scientific analysis. "
-                                "Pick Grayscale or Colomap for visualization.")
+                                "Pick Grayscale or Colomap for visualization, or RGB for the colormapped image "
+                                "as red, green and blue bands.")
             },
         ]
 
@@ -57,7 +64,7 @@ class NDVI():
           'compositeRasters': False,            # input is a single raster, band compositing doesn't apply.
           'inheritProperties': 4 | 8,           # inherit all but the pixel type and NoData from the input raster
           'invalidateProperties': 2 | 4 | 8,    # reset any statistics and histogram that might be held by the parent dataset (because this function modifies pixel values). 
-          'inputMask': False                    # Don't need input raster mask in .updatePixels().
+          'inputMask': True                     # Pixels of zero red plus infrared become NoData, in addition to the input's.
         }
 
 
@@ -65,6 +72,7 @@ class NDVI():
         method = kwargs.get('method', 'Colormap').lower()
         self.applyColormap = method == 'colormap'
         self.applyScaling = self.applyColormap or method == 'grayscale'
+        self.colorizer = colormaps.Colorizer('NDVI', scale=100.0, offset=100.0) if method == 'rgb' else None
               
         maximumValue = 1.0
         if self.applyScaling:                                   # maximum output value depends on whether we are scaling
@@ -74,31 +82,89 @@ class NDVI():
         pixelType = 'f4'
         if self.applyColormap:
             pixelType = 'u1'
-            colormap = (np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35, 36, 37, 38, 39, 40, 41, 42, 43, 44, 45, 46, 47, 48, 49, 50, 51, 52, 53, 54, 55, 56, 57, 58, 59, 60, 61, 62, 63, 64, 65, 66, 67, 68, 69, 70, 71, 72, 73, 74, 75, 76, 77, 78, 79, 80, 81, 82, 83, 84, 85, 86, 87, 88, 89, 90, 91, 92, 93, 94, 95, 96, 97, 98, 99, 100, 101, 102, 103, 104, 105, 106, 107, 108, 109, 110, 111, 112, 113, 114, 115, 116, 117, 118, 119, 120, 121, 122, 123, 124, 125, 126, 127, 128, 129, 130, 131, 132, 133, 134, 135, 136, 137, 138, 139, 140, 141, 142, 143, 144, 145, 146, 147, 148, 149, 150, 151, 152, 153, 154, 155, 156, 157, 158, 159, 160, 161, 162, 163, 164, 165, 166, 167, 168, 169, 170, 171, 172, 173, 174, 175, 176, 177, 178, 179, 180, 181, 182, 183, 184, 185, 186, 187, 188, 189, 190, 191, 192, 193, 194, 195, 196, 197, 198, 199, 200, 201, 202, 203, 204, 205, 206, 207, 208, 209, 210, 211, 212, 213, 214, 215, 216, 217, 218, 219, 220, 221, 222, 223, 224, 225, 226, 227, 228, 229, 230, 231, 232, 233, 234, 235, 236, 237, 238, 239, 240, 241, 242, 243, 244, 245, 246, 247, 248, 249, 250, 251, 252, 253, 254, 255], dtype='int32'),
-                        np.array([36, 36, 36, 36, 245, 245, 245, 245, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 253, 250, 244, 238, 234, 231, 223, 217, 211, 205, 200, 195, 189, 184, 180, 174, 169, 163, 160, 154, 148, 143, 138, 134, 130, 126, 117, 115, 112, 106, 100, 94, 92, 90, 81, 75, 71, 66, 62, 56, 51, 51, 51, 50, 50, 50, 50, 49, 49, 49, 48, 48, 48, 48, 48, 48, 48, 48, 47, 47, 47, 47, 46, 46, 46, 46, 45, 45, 45, 45, 44, 44, 44, 43, 43, 43, 43, 43, 43, 42, 42, 42, 42, 42, 42, 42, 41, 41, 41, 41, 40, 40, 40, 40, 40, 39, 39, 39, 39, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38], dtype='uint8'),
-                        np.array([0, 0, 0, 0, 20, 24, 29, 31, 33, 33, 37, 41, 41, 41, 45, 45, 47, 49, 49, 54, 54, 56, 58, 58, 62, 62, 62, 67, 67, 67, 69, 71, 71, 75, 75, 78, 79, 79, 79, 81, 83, 83, 87, 87, 90, 92, 93, 93, 97, 97, 97, 97, 101, 101, 101, 101, 105, 105, 107, 109, 109, 113, 118, 119, 121, 126, 132, 133, 135, 141, 144, 150, 152, 153, 159, 163, 165, 168, 174, 176, 181, 183, 186, 191, 197, 201, 203, 205, 209, 214, 216, 218, 224, 228, 234, 236, 238, 243, 248, 252, 252, 252, 250, 247, 246, 245, 240, 237, 235, 233, 230, 227, 224, 222, 220, 217, 214, 212, 210, 207, 204, 201, 199, 197, 194, 191, 189, 186, 184, 181, 179, 176, 174, 173, 168, 166, 163, 160, 158, 156, 153, 153, 153, 150, 150, 150, 150, 148, 148, 148, 145, 145, 145, 145, 143, 143, 143, 143, 140, 140, 140, 140, 138, 138, 138, 138, 135, 135, 135, 135, 133, 133, 133, 130, 130, 130, 130, 130, 130, 128, 128, 128, 125, 125, 125, 125, 122, 122, 122, 122, 120, 120, 120, 120, 120, 117, 117, 117, 117, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115], dtype='uint8'),
-                        np.array([255, 255, 255, 255, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 13, 20, 23, 25, 33, 38, 40, 43, 48, 54, 59, 61, 64, 69, 77, 79, 82, 87, 92, 97, 99, 102, 107, 115, 120, 123, 125, 130, 138, 141, 143, 150, 156, 163, 165, 168, 173, 181, 186, 186, 187, 180, 176, 173, 169, 163, 157, 150, 146, 142, 136, 132, 126, 123, 119, 114, 108, 105, 101, 96, 93, 88, 84, 81, 77, 70, 68, 64, 60, 55, 49, 47, 45, 37, 33, 28, 24, 21, 14, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0], dtype='uint8'))
+            colormap = colormaps.outputColormap('NDVI')        # loaded once, and shared by all instances
 
         kwargs['output_info']['bandCount'] = 1            # output is a single band raster
         kwargs['output_info']['statistics'] = ({'minimum': 0.0, 'maximum': maximumValue}, )  # we know something about the stats of the outgoing NDVI raster. 
+        if self.colorizer is not None:                      # ...or red, green and blue bands of raw NDVI expanded through the colormap
+            kwargs['output_info']['bandCount'] = self.colorizer.bandCount
+            kwargs['output_info']['statistics'] = tuple({'minimum': 0.0, 'maximum': 255.0} for b in range(self.colorizer.bandCount))
         kwargs['output_info']['histogram'] = ()           # we know nothing about the histogram of the outgoing raster.
-        kwargs['output_info']['pixelType'] = pixelType    # bit-depth of the outgoing NDVI raster based on user-specified parameters
+        kwargs['output_info']['pixelType'] = pixelType if self.colorizer is None else 'u1'   # bit-depth of the outgoing NDVI raster based on user-specified parameters
         kwargs['output_info']['colormap'] = colormap      # optional colormap if requesting for an color image
+
+        # 8-bit red and infrared have only 65,536 combinations: few enough to compute the output of each up front.
+        # Blocks then take a single gather per pixel instead of the float arithmetic and its cast. That wins at
+        # every tile size for 8-bit output, but a gather of float32 is slower than computing it, whatever the size.
+        self.table = None
+        if kwargs['raster_info']['pixelType'] == 'u1' and np.dtype(pixelType).itemsize == 1:
+            self.table = NDVI.tableCache.get((self.applyScaling, pixelType), lambda: self.computeTable(pixelType))
         return kwargs
 
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         inBlock = pixelBlocks['raster_pixels']                  # get the input raster pixel block
-        red = np.array(inBlock[0], dtype='f4')                  # extractbands ensures first band is Red.
-        ir = np.array(inBlock[1], dtype='f4')                   # extractbands ensures second band is Infrared
+        m = pixelBlocks['raster_mask']
+        outMask = np.empty(inBlock.shape[1:], 'u1')
+        np.logical_and(m[0], m[1], out=outMask)
+        valueType = 'f4' if self.colorizer is not None else props['pixelType']      # raw NDVI, if expanded below
+        if self.canLookup(inBlock, valueType):
+            outBlock = self.lookupNDVI(inBlock, outMask)
+        else:
+            red = inBlock[0]                                    # extractbands ensures first band is Red.
+            ir = inBlock[1]                                     # extractbands ensures second band is Infrared
+            outBlock = self.computeNDVI(red, ir, valueType, outMask)
+
+        if self.colorizer is not None:                          # expand into red, green and blue bands here, in one gather
+            outBlock = self.colorizer.apply(outBlock, outMask)
+            outMask = np.repeat(outMask[np.newaxis], self.colorizer.bandCount, axis=0)
+        pixelBlocks['output_pixels'] = outBlock
+        pixelBlocks['output_mask'] = outMask
+        return pixelBlocks
 
-        np.seterr(divide='ignore')
-        outBlock = (ir - red) / (ir + red)                      # compute NDVI
-        if self.applyScaling:
-            outBlock = (outBlock * 100.0) + 100.0               # apply a scale and offset to the the NDVI, if needed.
 
-        pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'])
-        return pixelBlocks
+    def computeNDVI(self, red, ir, pixelType, outMask=None):
+        # in float32, through two buffers: the output itself--unless it's of another type--and one scratch array.
+        # Pixels where red plus infrared is zero are cleared in outMask. Dividing them all the same, with the
+        # warnings silenced in this scope only, is faster than skipping them with where=.
+        shape = np.broadcast(red, ir).shape
+        with utils.bufferPool.scratch() as s:
+            outBlock = np.empty(shape, 'f4') if np.dtype(pixelType) == np.float32 else s.take(shape, 'f4')
+            t = s.take(shape, 'f4')
+            np.subtract(ir, red, out=outBlock, dtype='f4', casting='unsafe')     # compute NDVI
+            np.add(ir, red, out=t, dtype='f4', casting='unsafe')
+            if outMask is not None:
+                np.logical_and(outMask, t, out=outMask)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                outBlock /= t
+                if self.applyScaling:
+                    outBlock *= 100.0                           # apply a scale and offset to the the NDVI, if needed.
+                    outBlock += 100.0
+                return outBlock if outBlock.dtype == np.dtype(pixelType) else outBlock.astype(pixelType)
+
+
+    def computeTable(self, pixelType):
+        # output for every pair of 8-bit red and infrared values, by the same arithmetic as for pixel blocks,
+        # ravelled so that the output of (red, ir) is at 256*red + ir.
+        v = np.arange(256, dtype='f4')
+        return self.computeNDVI(v[:, np.newaxis], v[np.newaxis, :], pixelType).ravel()
+
+
+    def canLookup(self, inBlock, pixelType):
+        return self.table is not None and self.table.dtype == np.dtype(pixelType) and inBlock.dtype == np.uint8
+
+
+    def lookupNDVI(self, inBlock, outMask=None):
+        # a single gather from the table, by combined index of red and infrared. The index is built in 16 bits--a
+        # quarter of the memory traffic of np.intp--which np.take() converts faster than fancy indexing would.
+        # Index 0, where both are zero, is cleared in outMask.
+        with utils.bufferPool.scratch() as s:
+            k = s.copy(inBlock[0], 'u2')
+            k <<= 8
+            k |= inBlock[1]
+            if outMask is not None:
+                np.logical_and(outMask, k, out=outMask)
+            return np.take(self.table, k)
 
 
     def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
@@ -108,4 +174,6 @@ class NDVI():
             keyMetadata['wavelengthmin'] = None                 # reset inapplicable band-specific key metadata 
             keyMetadata['wavelengthmax'] = None
             keyMetadata['bandname'] = 'NDVI'
+        if bandIndex >= 0 and self.colorizer is not None:
+            keyMetadata['bandname'] = ('Red', 'Green', 'Blue', 'Alpha')[bandIndex]
         return keyMetadata
@@ -8,7 +8,7 @@ class SelectByPixelSize():
         self.description = "This function returns pixels associated with one of two input rasters based on the request resolution."
         self.threshold = 0.0
         self.inBands1, self.inBands2, self.outBands = 1, 1, 1
-        self.trace = utils.Trace()
+        self.trace = utils.Trace("SelectByPixelSize")
         
     def getParameterInfo(self):
         return [
@@ -58,8 +58,8 @@ class SelectByPixelSize():
         kwargs['output_info']['statistics'] = () 
         kwargs['output_info']['histogram'] = ()
 
-        self.trace.log("Trace|Threshold cell-size|{0}\n".format(self.threshold))
-        self.trace.log("Trace|output_info|{0}\n".format(kwargs['output_info']))
+        self.trace.log("Trace|Threshold cell-size|{0}\n", self.threshold)
+        self.trace.log("Trace|output_info|{0}\n", kwargs['output_info'])
         return kwargs
        
     def selectRasters(self, tlc, shape, props):
@@ -72,7 +72,7 @@ class SelectByPixelSize():
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
         cellSize = props['cellSize']
         v = 0.5 * (cellSize[0] + cellSize[1])
-        self.trace.log("Trace|Request cell-size|{0}\n".format(v))
+        self.trace.log("Trace|Request cell-size|{0}\n", v)
         
         if v < self.threshold:
             sPixels = 'r1_pixels'
@@ -0,0 +1,275 @@
+import ast
+import numpy as np
+import utils
+from collections import OrderedDict
+
+
+class SpectralIndices():
+    # index formulas over named bands; any other index is given as "Name = expression" in the indices parameter.
+    formulas = OrderedDict((
+        ('NDVI', "(nir - red) / (nir + red)"),
+        ('SAVI', "1.5 * (nir - red) / (nir + red + 0.5)"),
+        ('EVI', "2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)"),
+        ('NDWI', "(green - nir) / (green + nir)"),
+        ('NBR', "(nir - swir2) / (nir + swir2)"),
+        ('MSAVI', "(2 * nir + 1 - sqrt((2 * nir + 1) ** 2 - 8 * (nir - red))) / 2"),
+    ))
+    bandNames = ('blue', 'green', 'red', 'nir', 'swir1', 'swir2')
+
+    def __init__(self):
+        self.name = "Spectral Indices Function"
+        self.description = ("Computes one or more spectral indices--such as NDVI, SAVI, EVI, NDWI, NBR and MSAVI--"
+                            "of a multiband raster in one pass, as the bands of the output raster.")
+        self.program = None
+
+
+    def getParameterInfo(self):
+        bands = [
+            {
+                'name': b,
+                'dataType': 'numeric',
+                'value': v,
+                'required': False,
+                'displayName': "{0} Band Index".format(d),
+                'description': ("The index of the {0} band, used by indices that refer to '{1}'. "
+                                "The first band has index 1.").format(d.lower(), b)
+            } for b, d, v in zip(self.bandNames, ("Blue", "Green", "Red", "Near Infrared", "Shortwave Infrared 1",
+                                                  "Shortwave Infrared 2"), (2, 3, 4, 5, 6, 7))
+        ]
+        return [
+            {
+                'name': 'raster',
+                'dataType': 'raster',
+                'value': None,
+                'required': True,
+                'displayName': "Raster",
+                'description': "The primary multi-band input raster."
+            },
+            {
+                'name': 'indices',
+                'dataType': 'string',
+                'value': 'NDVI',
+                'required': True,
+                'displayName': "Indices",
+                'description': ("A comma-separated list of the indices to compute, one output band each: any of {0}, "
+                                "or Name = expression over the bands {1} with + - * / ** and sqrt() or abs(). "
+                                "Example: NDVI, SAVI, GNDVI = (nir - green) / (nir + green)").format(
+                                    ", ".join(self.formulas), ", ".join(self.bandNames))
+            },
+        ] + bands + [
+            {
+                'name': 'scaleFactor',
+                'dataType': 'numeric',
+                'value': 1.0,
+                'required': False,
+                'displayName': "Reflectance Scale Factor",
+                'description': ("Multiplies band values into reflectance before indices are computed, such as 0.0001 "
+                                "for reflectance scaled by 10,000. Indices with constant terms, such as SAVI, EVI and "
+                                "MSAVI, expect reflectance.")
+            },
+        ]
+
+
+    def getConfiguration(self, **scalars):
+        bands = dict((b, int(scalars.get(b, i + 2))) for i, b in enumerate(self.bandNames))
+        self.program = IndexProgram(scalars.get('indices', 'NDVI'), self.formulas, bands)
+
+        return {
+          'extractBands': self.program.extractBands,    # the bands needed by any of the indices, each read once.
+          'compositeRasters': False,
+          'inheritProperties': 4 | 8,                   # inherit all but the pixel type and NoData from the input raster
+          'invalidateProperties': 2 | 4 | 8,            # reset statistics, histogram and key properties of the input
+          'inputMask': True                             # undefined indices--such as 0/0--become NoData, in addition to the input's.
+        }
+
+
+    def updateRasterInfo(self, **kwargs):
+        self.scaleFactor = float(kwargs.get('scaleFactor', 1.0))
+        kwargs['output_info']['bandCount'] = len(self.program.names)    # one band per index
+        kwargs['output_info']['pixelType'] = 'f4'
+        kwargs['output_info']['statistics'] = ()
+        kwargs['output_info']['histogram'] = ()
+        return kwargs
+
+
+    def updatePixels(self, tlc, shape, props, **pixelBlocks):
+        inBlock = pixelBlocks['raster_pixels']
+        m = pixelBlocks['raster_mask']
+        outBlock = np.empty((len(self.program.names), ) + inBlock.shape[1:], 'f4')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.program.evaluate(inBlock, outBlock, self.scaleFactor)
+
+        outMask = np.empty(outBlock.shape, 'u1')
+        np.isfinite(outBlock, out=outMask)
+        outMask &= np.all(m, axis=0)                            # valid wherever all bands used are
+        pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False).reshape(shape)   # 2-D if one index
+        pixelBlocks['output_mask'] = outMask.reshape(shape)
+        return pixelBlocks
+
+
+    def updateKeyMetadata(self, names, bandIndex, **keyMetadata):
+        if bandIndex == -1:
+            keyMetadata['datatype'] = 'Scientific'
+        elif bandIndex < len(self.program.names):
+            keyMetadata['wavelengthmin'] = None                 # reset inapplicable band-specific key metadata
+            keyMetadata['wavelengthmax'] = None
+            keyMetadata['bandname'] = self.program.names[bandIndex]
+        return keyMetadata
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class IndexProgram():
+    # index formulas compiled into one sequence of NumPy operations. Formulas are parsed into expression trees
+    # whose nodes are keyed by structure--operands of + and * in a canonical order--so that a subterm common
+    # to several formulas, like nir - red in NDVI, SAVI and EVI, is a single node, evaluated once per block.
+    # Nodes are evaluated in float32 through pooled scratch arrays, each released once its last consumer is done,
+    # and the node of each index is written straight into its band of the output.
+
+    operators = {
+        'add': np.add, 'sub': np.subtract, 'mul': np.multiply, 'div': np.true_divide, 'pow': np.power,
+        'neg': np.negative, 'square': np.square, 'sqrt': np.sqrt, 'abs': np.absolute,
+    }
+    binaryOperators = {ast.Add: 'add', ast.Sub: 'sub', ast.Mult: 'mul', ast.Div: 'div', ast.Pow: 'pow'}
+    unaryOperators = {ast.USub: 'neg', ast.UAdd: None}
+    functions = ('sqrt', 'abs')
+
+    def __init__(self, indices, formulas, bands):
+        self.names, self.outputs = [], []
+        self.order, self.uses = [], {}              # nodes in evaluation order, and the number of their consumers
+        self.bands = bands
+
+        known = dict((k.lower(), k) for k in formulas)
+        for s in (k.strip() for k in indices.split(',')):
+            if not s:
+                continue
+            name, _, expression = s.partition('=')
+            name = name.strip()
+            if not _:
+                if name.lower() not in known:
+                    raise Exception("Unrecognized index: '{0}'. Specify one of {1}, or Name = expression.".format(
+                                    name, ", ".join(formulas)))
+                name = known[name.lower()]
+                expression = formulas[name]
+            self.names.append(name)
+            self.outputs.append(self.compile(name, expression))
+
+        if not self.outputs:
+            raise Exception("Specify at least one index to compute.")
+
+        used = sorted(set(self.bands[k[1]] for k in self.order if k[0] == 'band'))
+        if any(b < 1 for b in used):
+            raise Exception("Band indexes start at 1: {0}".format(used))
+        self.extractBands = tuple(b - 1 for b in used)
+        self.positions = dict((b, used.index(self.bands[b])) for b in self.bands if self.bands[b] in used)
+
+        self.targets = {}                           # node -> band of the output it's computed into
+        for i, k in enumerate(self.outputs):
+            if k[0] not in ('band', 'const') and k not in self.targets:
+                self.targets[k] = i
+
+
+    def compile(self, name, expression):
+        try:
+            tree = ast.parse(expression.strip(), mode='eval').body
+        except SyntaxError:
+            raise Exception("Index '{0}' has an invalid expression: {1}".format(name, expression))
+        return self.node(tree, name)
+
+
+    def node(self, e, name):
+        t = type(e).__name__
+        if t in ('Num', 'Constant'):
+            v = e.value if hasattr(e, 'value') else e.n
+            if isinstance(v, bool) or not isinstance(v, (int, float)):
+                raise Exception("Index '{0}' has an unsupported constant: {1!r}".format(name, v))
+            return self.add(('const', float(v)))
+        if t == 'Name':
+            if e.id not in self.bands:
+                raise Exception("Index '{0}' refers to an unknown band: '{1}'. Expected one of {2}.".format(
+                                name, e.id, ", ".join(sorted(self.bands))))
+            return self.add(('band', e.id))
+        if t == 'BinOp' and type(e.op) in self.binaryOperators:
+            op = self.binaryOperators[type(e.op)]
+            a, b = self.node(e.left, name), self.node(e.right, name)
+            if op == 'pow' and b == ('const', 2.0):
+                return self.apply('square', a)
+            return self.apply(op, a, b)
+        if t == 'UnaryOp' and type(e.op) in self.unaryOperators:
+            a = self.node(e.operand, name)
+            op = self.unaryOperators[type(e.op)]
+            return self.apply(op, a) if op else a
+        if t == 'Call' and type(e.func).__name__ == 'Name' and e.func.id in self.functions and len(e.args) == 1:
+            return self.apply(e.func.id, self.node(e.args[0], name))
+        raise Exception("Index '{0}' has an unsupported expression: {1}".format(name, ast.dump(e)))
+
+
+    def apply(self, op, *args):
+        if all(k[0] == 'const' for k in args):      # folded
+            return self.add(('const', float(self.operators[op](*[k[1] for k in args]))))
+        if op in ('add', 'mul'):
+            args = tuple(sorted(args, key=repr))    # a + b and b + a are the same node, and bit for bit the same value
+        return self.add((op, ) + tuple(args))
+
+
+    def add(self, key):
+        if key not in self.uses:
+            self.uses[key] = 0
+            self.order.append(key)
+            for k in key[1:] if key[0] not in ('band', 'const') else ():
+                self.uses[k] += 1
+        return key
+
+
+    def evaluate(self, inBlock, outBlock, scaleFactor=1.0):
+        shape = inBlock.shape[1:]
+        uses = dict(self.uses)
+        values, free = {}, []
+
+        with utils.bufferPool.scratch() as s:
+            for key in self.order:
+                op = key[0]
+                if op == 'const':
+                    values[key] = key[1]
+                    continue
+                if op == 'band':                    # each band used is converted to float32 once
+                    b = inBlock[self.positions[key[1]]]
+                    if scaleFactor != 1.0:
+                        v = s.take(shape, 'f4')
+                        np.multiply(b, scaleFactor, out=v, dtype='f4', casting='unsafe')
+                    else:
+                        v = s.asType(b, 'f4')
+                    values[key] = v
+                    continue
+
+                i = self.targets.get(key, None)
+                out = outBlock[i] if i is not None else (free.pop() if free else s.take(shape, 'f4'))
+                self.operators[op](*[values[k] for k in key[1:]], out=out, dtype='f4', casting='unsafe')
+                values[key] = out
+                for k in key[1:]:
+                    uses[k] -= 1
+                    if uses[k] == 0 and k[0] not in ('band', 'const') and k not in self.targets:
+                        free.append(values.pop(k))  # reused by the next node
+
+            for i, key in enumerate(self.outputs):  # indices that are a band, a constant, or repeated
+                if self.targets.get(key, None) != i:
+                    outBlock[i] = values[key]
+        return outBlock
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+"""
+References:
+    [1]. Huete, A.R., 1988. A soil-adjusted vegetation index (SAVI).
+         Remote Sensing of Environment 25 (3), 295-309.
+    [2]. Huete, A., Didan, K., Miura, T., Rodriguez, E.P., Gao, X., Ferreira, L.G., 2002. Overview of the
+         radiometric and biophysical performance of the MODIS vegetation indices.
+         Remote Sensing of Environment 83 (1-2), 195-213.
+    [3]. McFeeters, S.K., 1996. The use of the Normalized Difference Water Index (NDWI) in the delineation
+         of open water features. International Journal of Remote Sensing 17 (7), 1425-1432.
+    [4]. Key, C.H., Benson, N.C., 2006. Landscape assessment: ground measure of severity, the Composite Burn Index;
+         and remote sensing of severity, the Normalized Burn Ratio. USDA Forest Service RMRS-GTR-164-CD.
+    [5]. Qi, J., Chehbouni, A., Huete, A.R., Kerr, Y.H., Sorooshian, S., 1994. A modified soil adjusted
+         vegetation index. Remote Sensing of Environment 48 (2), 119-126.
+"""
@@ -1,4 +1,6 @@
 import numpy as np
+import utils
+from Hillshade import Hillshade
 
 
 class VineyardAnalysis():
@@ -6,6 +8,7 @@ class VineyardAnalysis():
     def __init__(self):
         self.name = "Vineyard Suitability Analysis Function"
         self.description = "This function computes vineyard suitability given elevation, slope, aspect, and soil-type rasters."
+        self.terrain = None         # computes slope and aspect from elevation, if requested
 
     def getParameterInfo(self):
         return [
@@ -21,17 +24,17 @@ class VineyardAnalysis():
                 'name': 'slope',
                 'dataType': 'raster',
                 'value': None,
-                'required': True,
+                'required': False,
                 'displayName': "Slope Raster",
-                'description': "A single-band raster where pixel values represent slope."
+                'description': "A single-band raster where pixel values represent slope. Not used if slope and aspect are derived from elevation."
             },
             {
                 'name': 'aspect',
                 'dataType': 'raster',
                 'value': None,
-                'required': True,
+                'required': False,
                 'displayName': "Aspect Raster",
-                'description': "A single-band raster where pixel values represent aspect."
+                'description': "A single-band raster where pixel values represent aspect. Not used if slope and aspect are derived from elevation."
             },
             {
                 'name': 'soiltype',
@@ -41,13 +44,24 @@ class VineyardAnalysis():
                 'displayName': "Soil Type Raster",
                 'description': "A single-band thematic raster where pixel values represent soil type."
             },
+            {
+                'name': 'derive',
+                'dataType': 'boolean',
+                'value': False,
+                'required': False,
+                'displayName': "Derive Slope and Aspect",
+                'description': ("Compute slope and aspect from the elevation raster instead of reading them from "
+                                "separate rasters. Requires only one read of the elevation raster per pixel block.")
+            },
         ]
 
     def getConfiguration(self, **scalars):
+        derive = bool(scalars.get('derive', False))
         return {
             'inheritProperties': 2 | 4 | 8,     # inherit all but the pixel type from the input raster
             'invalidateProperties': 2 | 4 | 8,  # reset any statistics and histogram that might be held by
                                                 #   the parent dataset (because this function modifies pixel values).
+            'padding': 1 if derive else 0,      # slope and aspect from elevation need one extra pixel on each side
             'inputMask': True                   # We need the input raster mask in .updatePixels().
         }
 
@@ -56,17 +70,32 @@ class VineyardAnalysis():
         kwargs['output_info']['pixelType'] = 'u1'
         kwargs['output_info']['statistics'] = ({'minimum': 0, 'maximum': 3}, )
         kwargs['output_info']['noData'] = np.array([0], 'u1')
+
+        self.terrain = None
+        if kwargs.get('derive', False):
+            self.terrain = Hillshade()      # share Hillshade's gradient, z-factor, and cell-size logic
+            self.terrain.prepare(cellSizeFactor=0., sr=kwargs['elevation_info']['spatialReference'])
         return kwargs
 
     def updatePixels(self, tlc, shape, props, **pixelBlocks):
-        elev = np.array(pixelBlocks['elevation_pixels'], dtype='f4', copy=False)
-        slope = np.array(pixelBlocks['slope_pixels'], dtype='f4', copy=False)
-        aspect = np.array(pixelBlocks['aspect_pixels'], dtype='f4', copy=False)
-        # soil = np.array(pixelBlocks['soiltype_pixels'], 'i8')
+        with utils.bufferPool.scratch() as s:
+            elev = s.asType(pixelBlocks['elevation_pixels'], 'f4')
+            if self.terrain is not None:
+                n = elev.shape[:-2] + (elev.shape[-2] - 2, elev.shape[-1] - 2)
+                dx, dy = self.terrain.computeGradients(elev, props, None, None, s.take(n, 'f4'), s.take(n, 'f4'))
+                aspect = self.terrain.computeAspect(dx, dy, out=s.take(n, 'f4'))
+                slope = self.terrain.computeSlope(dx, dy, out=dx)
+                elev = elev[..., 1:-1, 1:-1]
+                m = np.asarray(pixelBlocks['elevation_mask'], dtype='u1')
+                pixelBlocks['output_mask'] = utils.erodeMask(m, 1)
+            else:
+                slope = s.asType(pixelBlocks['slope_pixels'], 'f4')
+                aspect = s.asType(pixelBlocks['aspect_pixels'], 'f4')
+            # soil = np.array(pixelBlocks['soiltype_pixels'], 'i8')
 
-        E = (elev > 30).astype('u1', copy=False) & (elev < 400).astype('u1', copy=False)
-        S = (slope > 5).astype('u1', copy=False) & (slope < 60).astype('u1', copy=False)
-        A = (aspect > 0).astype('u1', copy=False) & (aspect < 200).astype('u1', copy=False)
+            E = (elev > 30).astype('u1', copy=False) & (elev < 400).astype('u1', copy=False)
+            S = (slope > 5).astype('u1', copy=False) & (slope < 60).astype('u1', copy=False)
+            A = (aspect > 0).astype('u1', copy=False) & (aspect < 200).astype('u1', copy=False)
         pixelBlocks['output_pixels'] = (E + S + A).astype(props['pixelType'], copy=False)
         return pixelBlocks
 
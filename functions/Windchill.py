@@ -1,4 +1,5 @@
 import numpy as np
+import utils
 
 
 class Windchill():
@@ -43,11 +44,19 @@ class Windchill():
         return kwargs
 
     def updatePixels(self, tlc, size, props, **pixelBlocks):
-        ws = np.array(pixelBlocks['ws_pixels'], dtype='f4', copy=False)
-        t = np.array(pixelBlocks['temperature_pixels'], dtype='f4', copy=False)
+        with utils.bufferPool.scratch() as s:
+            ws = s.asType(pixelBlocks['ws_pixels'], 'f4')
+            t = s.asType(pixelBlocks['temperature_pixels'], 'f4')
 
-        ws16 = np.power(ws, 0.16)
-        outBlock = 35.74 + (0.6215 * t) - (35.75 * ws16) + (0.4275 * t * ws16)
+            # 35.74 + (0.6215 * t) - (35.75 * ws16) + (0.4275 * t * ws16), term by term
+            ws16 = np.power(ws, 0.16, out=s.take(ws.shape, 'f4'))
+            w = s.take(ws.shape, 'f4')
+            outBlock = np.multiply(t, 0.6215)
+            outBlock += 35.74
+            outBlock -= np.multiply(ws16, 35.75, out=w)
+            np.multiply(t, 0.4275, out=w)
+            w *= ws16
+            outBlock += w
         pixelBlocks['output_pixels'] = outBlock.astype(props['pixelType'], copy=False)
         return pixelBlocks
 
@@ -0,0 +1,150 @@
+import numpy as np
+import utils
+
+__all__ = ['colormapNames',
+           'getColormap',
+           'outputColormap',
+           'Colorizer']
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+# Named colormaps, loaded once at import into read-only (3, n) uint8 arrays of red, green and blue, and
+# shared by every function that uses them. A function either attaches one to its output raster as the colormap
+# in output_info--for the client to expand--or expands its pixels into RGB(A) bands itself with a Colorizer.
+
+# 256 entries, indexed by NDVI scaled to [0, 200].
+ndviColors = (
+    # red
+    (
+        36, 36, 36, 36, 245, 245, 245, 245, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247, 247,
+        247, 247, 247, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250, 250,
+        250, 250, 250, 250, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 252, 255,
+        255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255,
+        255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 255, 253, 250, 244, 238, 234,
+        231, 223, 217, 211, 205, 200, 195, 189, 184, 180, 174, 169, 163, 160, 154, 148, 143, 138, 134, 130, 126,
+        117, 115, 112, 106, 100, 94, 92, 90, 81, 75, 71, 66, 62, 56, 51, 51, 51, 50, 50, 50, 50, 49, 49, 49, 48,
+        48, 48, 48, 48, 48, 48, 48, 47, 47, 47, 47, 46, 46, 46, 46, 45, 45, 45, 45, 44, 44, 44, 43, 43, 43, 43,
+        43, 43, 42, 42, 42, 42, 42, 42, 42, 41, 41, 41, 41, 40, 40, 40, 40, 40, 39, 39, 39, 39, 38, 38, 38, 38,
+        38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38,
+        38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38, 38,
+        38
+    ),
+    # green
+    (
+        0, 0, 0, 0, 20, 24, 29, 31, 33, 33, 37, 41, 41, 41, 45, 45, 47, 49, 49, 54, 54, 56, 58, 58, 62, 62, 62,
+        67, 67, 67, 69, 71, 71, 75, 75, 78, 79, 79, 79, 81, 83, 83, 87, 87, 90, 92, 93, 93, 97, 97, 97, 97, 101,
+        101, 101, 101, 105, 105, 107, 109, 109, 113, 118, 119, 121, 126, 132, 133, 135, 141, 144, 150, 152, 153,
+        159, 163, 165, 168, 174, 176, 181, 183, 186, 191, 197, 201, 203, 205, 209, 214, 216, 218, 224, 228, 234,
+        236, 238, 243, 248, 252, 252, 252, 250, 247, 246, 245, 240, 237, 235, 233, 230, 227, 224, 222, 220, 217,
+        214, 212, 210, 207, 204, 201, 199, 197, 194, 191, 189, 186, 184, 181, 179, 176, 174, 173, 168, 166, 163,
+        160, 158, 156, 153, 153, 153, 150, 150, 150, 150, 148, 148, 148, 145, 145, 145, 145, 143, 143, 143, 143,
+        140, 140, 140, 140, 138, 138, 138, 138, 135, 135, 135, 135, 133, 133, 133, 130, 130, 130, 130, 130, 130,
+        128, 128, 128, 125, 125, 125, 125, 122, 122, 122, 122, 120, 120, 120, 120, 120, 117, 117, 117, 117, 115,
+        115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115,
+        115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115,
+        115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115, 115
+    ),
+    # blue
+    (
+        255, 255, 255, 255, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 13, 20, 23, 25,
+        33, 38, 40, 43, 48, 54, 59, 61, 64, 69, 77, 79, 82, 87, 92, 97, 99, 102, 107, 115, 120, 123, 125, 130,
+        138, 141, 143, 150, 156, 163, 165, 168, 173, 181, 186, 186, 187, 180, 176, 173, 169, 163, 157, 150, 146,
+        142, 136, 132, 126, 123, 119, 114, 108, 105, 101, 96, 93, 88, 84, 81, 77, 70, 68, 64, 60, 55, 49, 47,
+        45, 37, 33, 28, 24, 21, 14, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+        0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+    ),
+)
+
+# (position in [0, 1], (red, green, blue)) stops of colormaps interpolated over 256 entries.
+colorRamps = {
+    'Elevation': ((0., (56, 168, 0)), (0.25, (171, 205, 102)), (0.5, (255, 235, 175)),
+                  (0.75, (168, 112, 0)), (1., (255, 255, 255))),
+    'Diverging': ((0., (5, 48, 97)), (0.5, (247, 247, 247)), (1., (103, 0, 31))),
+}
+
+
+def rampColors(stops, n=256):
+    x = np.linspace(0., 1., n)
+    p = [s[0] for s in stops]
+    return [np.rint(np.interp(x, p, [s[1][i] for s in stops])) for i in range(3)]
+
+
+def loadColormap(colors):
+    a = np.array(colors, dtype='u1')
+    if a.ndim != 2 or a.shape[0] != 3:
+        raise Exception("Expected red, green and blue values of a colormap but found an array of shape {0}".format(a.shape))
+    a.setflags(write=False)
+    return a
+
+
+colormaps = dict([('NDVI', loadColormap(ndviColors)),
+                  ('Grayscale', loadColormap([np.arange(256)] * 3))] +
+                 [(k, loadColormap(rampColors(v))) for k, v in colorRamps.items()])
+colormapNames = tuple(sorted(colormaps))
+outputColormaps = utils.LRUCache(maxSize=len(colormaps))
+
+
+def colormapName(name):
+    for k in colormapNames:
+        if k.lower() == str(name).lower():
+            return k
+    raise Exception("Unrecognized colormap: {0}. Expected one of {1}.".format(name, ", ".join(colormapNames)))
+
+
+def getColormap(name):
+    # the (3, n) uint8 array of a named colormap, in any case.
+    return colormaps[colormapName(name)]
+
+
+def outputColormap(name):
+    # a named colormap as the colormap of output_info: pixel values as int32, and red, green and blue as uint8.
+    def build(c):
+        values = np.arange(c.shape[1], dtype='int32')
+        values.setflags(write=False)
+        return (values, c[0], c[1], c[2])
+    k = colormapName(name)
+    return outputColormaps.get(k, lambda: build(colormaps[k]))
+
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ##
+
+class Colorizer():
+    # expands a band of values into red, green, blue--and alpha--uint8 bands through a named colormap:
+    #   c = Colorizer('NDVI', scale=100., offset=100.)     # or Colorizer.forRange('Elevation', 0., 3000.)
+    #   pixelBlocks['output_pixels'] = c.apply(ndvi, mask)
+    # The entry of a value is value * scale + offset, truncated and clamped to the colormap--as casting the
+    # scaled values to uint8 and expanding those through an output colormap would. All bands are gathered from
+    # one table by a single np.take. Its last entry is that of NoData: black, and transparent with alpha.
+
+    def __init__(self, colormap, scale=1., offset=0., alpha=False):
+        c = getColormap(colormap)
+        self.size = c.shape[1]
+        self.scale, self.offset = float(scale), float(offset)
+        self.table = np.zeros((4 if alpha else 3, self.size + 1), 'u1')
+        self.table[:3, :-1] = c
+        if alpha:
+            self.table[3, :-1] = 255
+        self.bandCount = self.table.shape[0]
+
+    @staticmethod
+    def forRange(colormap, minimum, maximum, alpha=False):
+        # spreads values in [minimum, maximum) over the whole colormap.
+        scale = getColormap(colormap).shape[1] / float(maximum - minimum)
+        return Colorizer(colormap, scale, -minimum * scale, alpha)
+
+    def apply(self, values, mask=None):
+        shape = np.shape(values)
+        with utils.bufferPool.scratch() as s:
+            t = s.take(shape, 'f4')
+            np.multiply(values, self.scale, out=t, dtype='f4', casting='unsafe')
+            t += self.offset
+            np.clip(t, 0., self.size - 1., out=t)
+            k = s.take(shape, np.intp)
+            with np.errstate(invalid='ignore'):
+                np.copyto(k, t, casting='unsafe')       # NaN becomes an out-of-range index, clipped to the first entry
+            if mask is not None:
+                np.copyto(k, self.size, where=np.logical_not(mask))
+            return np.take(self.table, k, axis=1, mode='clip')
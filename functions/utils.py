@@ -1,7 +1,18 @@
+import os
+import sys
+import time
+import numpy as np
+import threading
+from collections import OrderedDict, deque
+
 __all__ = ['isProductVersionOK',
            'computePixelBlockExtents',
            'computeCellSize',
+           'erodeMask',
            'Projection',
+           'LRUCache',
+           'BufferPool',
+           'bufferPool',
            'Trace']
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
@@ -22,7 +33,7 @@ def computePixelBlockExtents(tlc, shape, props):
 
 def computeCellSize(props, sr=None, proj=None):
     e, w, h = props['extent'], props['width'], props['height']  # dimensions of parent raster
-    if sr is None:
+    if sr is None or sr == props['spatialReference']:
         return (e[2]-e[0])/w, (e[3]-e[1])/h                     # cell size of parent raster
 
     if proj is None:
@@ -34,40 +45,243 @@ def computeCellSize(props, sr=None, proj=None):
     return (xMax-xMin)/w, (yMax-yMin)/h                         # cell size of parent raster
 
 
+def erodeMask(mask, padding=1):
+    # minimum over a (2*padding+1)-square neighborhood of a padded mask, returned for the interior only.
+    # separable: a running minimum down the rows followed by one across the columns.
+    r, c = mask.shape[-2:]
+    k = 2*padding
+    with bufferPool.scratch() as s:
+        t = s.copy(mask[..., :r-k, :], mask.dtype)
+        for i in range(1, k+1):
+            np.minimum(t, mask[..., i:r-k+i, :], out=t)
+
+        outMask = np.array(t[..., :, :c-k])
+        for i in range(1, k+1):
+            np.minimum(outMask, t[..., :, i:c-k+i], out=outMask)
+    return outMask
+
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
 
 class Projection():
     def __init__(self):
         pyprojModule = __import__('pyproj')
-        self._inProj, self._outProj = None, None
-        self._inEPSG, self._outEPSG = -1, -1
+        self._transformers = {}                 # one reusable transformation per (inEPSG, outEPSG) pair
 
+        self._transformerClass = getattr(pyprojModule, 'Transformer', None)
         self._projClass = getattr(pyprojModule, 'Proj')
-        self._transformFunc = getattr(pyprojModule, 'transform')
+        self._transformFunc = getattr(pyprojModule, 'transform', None)
 
     def transform(self, inEPSG, outEPSG, x, y):
-        if inEPSG != self._inEPSG:
-            self._inProj = self._projClass("+init=EPSG:{0}".format(inEPSG))
-            self._inEPSG = inEPSG
+        t = self._transformers.get((inEPSG, outEPSG), None)
+        if t is None:
+            t = self._createTransform(inEPSG, outEPSG)
+            self._transformers[(inEPSG, outEPSG)] = t
+        return t(x, y)
+
+    def _createTransform(self, inEPSG, outEPSG):
+        if self._transformerClass is not None:
+            return self._transformerClass.from_crs(inEPSG, outEPSG, always_xy=True).transform
+
+        inProj = self._projClass("+init=EPSG:{0}".format(inEPSG))
+        outProj = self._projClass("+init=EPSG:{0}".format(outEPSG))
+        return lambda x, y: self._transformFunc(inProj, outProj, x, y)
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
+
+
+class LRUCache():
+    def __init__(self, maxSize=64):
+        self.maxSize = maxSize
+        self.hits, self.misses = 0, 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        # return the value cached for key, or compute(), cache, and return it.
+        # the least recently used entry is evicted once more than maxSize values are held.
+        with self._lock:
+            if key in self._items:
+                self.hits += 1
+                v = self._items.pop(key)
+                self._items[key] = v
+                return v
+            self.misses += 1
+
+        v = compute()
+        with self._lock:
+            self._items[key] = v
+            while len(self._items) > self.maxSize:
+                self._items.popitem(last=False)
+        return v
 
-        if outEPSG != self._outEPSG:
-            self._outProj = self._projClass("+init=EPSG:{0}".format(outEPSG))
-            self._outEPSG = outEPSG
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits, self.misses = 0, 0
 
-        return self._transformFunc(self._inProj, self._outProj, x, y)
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'maxSize': self.maxSize}
+
+# ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
+
+
+class BufferPool():
+    # Scratch arrays reused across calls instead of being allocated anew for every pixel block. Free arrays are
+    # kept per thread, keyed by (shape, dtype), at most maxArrays per key and maxBytes in all. Arrays are taken for
+    # the duration of a call through a Scratch, and return to the pool when it exits:
+    #   with utils.bufferPool.scratch() as s:
+    #       t = s.asType(pixelBlocks['raster_pixels'], 'f4')   # a pooled copy, unless already float32
+    #       w = s.take(t.shape, 'f4')                           # uninitialized
+    #       ...
+    # Output pixel blocks outlive the call, so they must not be scratch arrays.
+
+    def __init__(self, maxBytes=1 << 28, maxArrays=8):
+        self.maxBytes, self.maxArrays = maxBytes, maxArrays
+        self._local = threading.local()
+
+    def _free(self):
+        l = self._local
+        if not hasattr(l, 'arrays'):
+            l.arrays, l.bytes, l.hits, l.misses = {}, 0, 0, 0
+        return l
+
+    def take(self, shape, dtype='f4'):
+        shape, dtype = tuple(shape), np.dtype(dtype)
+        l = self._free()
+        free = l.arrays.get((shape, dtype.str), None)
+        if free:
+            a = free.pop()
+            l.bytes -= a.nbytes
+            l.hits += 1
+            return a
+        l.misses += 1
+        return np.empty(shape, dtype)
+
+    def give(self, *arrays):
+        l = self._free()
+        for a in arrays:
+            free = l.arrays.setdefault((a.shape, a.dtype.str), [])
+            if len(free) < self.maxArrays and l.bytes + a.nbytes <= self.maxBytes:
+                free.append(a)
+                l.bytes += a.nbytes
+
+    def scratch(self):
+        return Scratch(self)
+
+    def clear(self):
+        l = self._free()
+        l.arrays, l.bytes = {}, 0
+
+    def info(self):
+        # of the calling thread's free lists.
+        l = self._free()
+        return {'hits': l.hits, 'misses': l.misses, 'arrays': sum(len(v) for v in l.arrays.values()),
+                'bytes': l.bytes, 'maxBytes': self.maxBytes}
+
+
+class Scratch():
+    # arrays taken from a BufferPool for one call. Returned to the pool on exit from the with-block.
+
+    def __init__(self, pool):
+        self.pool, self.arrays = pool, []
+
+    def take(self, shape, dtype='f4'):
+        a = self.pool.take(shape, dtype)
+        self.arrays.append(a)
+        return a
+
+    def copy(self, a, dtype='f4'):
+        b = self.take(np.shape(a), dtype)
+        np.copyto(b, a, casting='unsafe')
+        return b
+
+    def asType(self, a, dtype='f4'):
+        # a itself if it's already an ndarray of dtype--to be read, not written--else a pooled copy.
+        return a if isinstance(a, np.ndarray) and a.dtype == np.dtype(dtype) else self.copy(a, dtype)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.pool.give(*self.arrays)
+        self.arrays = []
+
+
+bufferPool = BufferPool()
 
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #
 
 
 class Trace():
-    def __init__(self):
-        ctypes = __import__('ctypes')
-        self.trace = ctypes.windll.kernel32.OutputDebugStringA
-        self.trace.argtypes = [ctypes.c_char_p]
-        self.c_char_p = ctypes.c_char_p
+    # Trace messages and structured events, off by default. Messages are formatted only while a sink is enabled:
+    #   trace.log("Trace|Request Size|{0}\n", shape)
+    #   trace.event('updatePixels', shape=shape)
+    # Sinks are shared by all Trace objects, and are enabled with Trace.configure() or the environment variable
+    # RASTER_FUNCTIONS_TRACE--a comma-separated list of:
+    #   . debugger: OutputDebugStringA on Windows, for DebugView and attached debuggers. stderr elsewhere.
+    #   . stderr:   one line per message.
+    #   . memory:   a ring buffer of the latest events, as dicts, returned by Trace.events().
+    # Any callable accepting (event, text) is a sink too. Disabled, a call is an attribute test and a return.
+
+    enabled = False
+    sinks = ()
+    buffer = deque(maxlen=4096)
 
-    def log(self, s):
-        self.trace(self.c_char_p(s.encode('utf-8')))
+    def __init__(self, name=None):
+        self.name = name
+
+    def log(self, s, *args, **kwargs):
+        if not self.enabled:
+            return s
+        s = s.format(*args, **kwargs) if args or kwargs else s
+        self.emit({'message': s}, s)
         return s
 
+    def event(self, name, **fields):
+        if not self.enabled:
+            return
+        text = "Trace|{0}|{1}|{2}\n".format(self.name, name, "|".join("{0}={1}".format(k, fields[k]) for k in sorted(fields)))
+        self.emit({'event': name, 'fields': fields}, text)
+
+    def emit(self, e, text):
+        e.update(time=time.time(), thread=threading.current_thread().name, source=self.name)
+        for sink in self.sinks:
+            sink(e, text)
+
+    @staticmethod
+    def configure(sinks=('memory', ), capacity=None):
+        if hasattr(sinks, 'split'):
+            sinks = [k.strip() for k in sinks.split(',') if k.strip()]
+        if capacity is not None:
+            Trace.buffer = deque(maxlen=capacity)
+        Trace.sinks = tuple(traceSink(k) for k in sinks)
+        Trace.enabled = len(Trace.sinks) > 0
+
+    @staticmethod
+    def disable():
+        Trace.configure(())
+
+    @staticmethod
+    def events():
+        return list(Trace.buffer)
+
+
+def traceSink(sink):
+    if callable(sink):
+        return sink
+    if sink == 'memory':
+        return lambda e, text: Trace.buffer.append(e)
+    if sink == 'stderr' or (sink == 'debugger' and not hasattr(__import__('ctypes'), 'windll')):
+        return lambda e, text: sys.stderr.write(text if text.endswith('\n') else text + '\n')
+    if sink == 'debugger':
+        ctypes = __import__('ctypes')
+        f = ctypes.windll.kernel32.OutputDebugStringA
+        f.argtypes = [ctypes.c_char_p]
+        return lambda e, text: f(ctypes.c_char_p(text.encode('utf-8')))
+    raise Exception("Unrecognized trace sink: {0}".format(sink))
+
+
+Trace.configure(os.environ.get('RASTER_FUNCTIONS_TRACE', ''))
+
 # ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- ## ----- #